@@ -1,51 +1,98 @@
 # Python-specific imports
+import collections
 import numpy as np
 import time
 import cv2
-import matplotlib.pyplot as plt
 
 # Package-specific imports
-from find_intersect import intersection_of_polygons
-from detect_image import load_labels
+from model_session import DnnSession
+
+# Vehicle boxes kept in the last frame, in full frame coordinates, whether each one is within any lane of the ROI,
+# the (lanes, boxes) flags of which lanes each one is in and the names of the lanes
+VehicleDetections = collections.namedtuple('VehicleDetections', ['boxes', 'accepted', 'lanes', 'lane_names'],
+	defaults=(np.zeros((0, 0), dtype=bool), ()))
+NO_VEHICLES = VehicleDetections(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=bool))
+
+def lane_counts(detections):
+	"""
+		returns a dictionary with the number of vehicles in each lane of a VehicleDetections, lanes without vehicles included
+	"""
+	return dict(zip(detections.lane_names, detections.lanes.sum(axis=1).tolist()))
 
 class YoloVideo:
 	"""
 		Detection model to identify cars and trucks within a specific region of interest (ROI)
 	"""
 
-	def __init__(self, net):
+	def __init__(self, net, crop_to_roi=False, crop_padding=0.1):
 		"""
+			net: DnnSession, or a network from cv2.dnn.readNetFromDarknet that gets wrapped in one
+			crop_to_roi: run inference only on the bounding rectangle of the ROI instead of the whole frame
+			crop_padding: fraction of the ROI size added around its bounding rectangle when cropping
+			self.session: model session holding the network, labels and output layer names
 			self.frame: frame from stream
+			self.inference_frame: part of self.frame the model runs on, the whole frame unless cropping to the ROI
+			self.crop_offset: (x, y) of self.inference_frame in self.frame, added to the detected boxes
 			self.ROI: nested list defining region of intereest in frame in which we detect vehicles
+			self.prepared_roi: PreparedROISet used to evaluate all detected boxes against every lane of the ROI at once
 			self.confidence: minimum probability to filter weak detections
 			self.threshold: threshold when applying non-maxima suppression
+			self.vehicle_detections: VehicleDetections of the last frame, used by the trackers
+			self.batch_vehicle_detections: VehicleDetections of every frame of the last batch
+			self.stage_times: seconds spent in each stage (preprocess, forward, decode, nms, roi, debug) on the last frame
+			self.batch_stage_times: stage_times of every frame of the last batch
 		"""
-		self.net = net
+		self.session = self.build_session(net)
+		self.net = self.session.net
 		self.frame = None
+		self.crop_to_roi = crop_to_roi
+		self.crop_padding = crop_padding
+		self.inference_frame = None
+		self.crop_offset = (0, 0)
 		self.ROI = []
+		self.prepared_roi = None
 		self.confidence = 0.20
 		self.threshold = 0.3
 		self.debug = True
-		self.labels = load_labels(self.get_yolo_labels()) if self.get_yolo_labels() else {}
+		self.labels = self.session.labels
 		self.pickedClass = ['car', 'motorcycle', 'truck']
 		self.detection_info = None
+		self.vehicle_detections = NO_VEHICLES
+		self.batch_vehicle_detections = []
+		self.stage_times = {}
+		self.batch_stage_times = []
 		self.DEBUG_IMAGE = np.ones([100,100,3],dtype=np.uint8) * 55
 		
 
+	def build_session(self, net):
+		"""
+			return the model session used for inference, labels and layer names are resolved once here
+		"""
+		if isinstance(net, DnnSession):
+			return net
+		return DnnSession(net, labels_path=self.get_yolo_labels())
+
 	def set_frame_and_roi(self,frame,camera):
 		"""
-			resize the ROI to match the frame
+			use the camera's ROI resized to match the frame, the camera only rebuilds it when the ROI or resolution changes
 		"""
 		self.frame = frame
+		self.stage_times = {}
+		self.prepared_roi = camera.get_prepared_roi()
+		self.ROI = self.prepared_roi.coordinates
+		self.inference_frame, self.crop_offset = self.crop_frame(frame)
 
-		# Ratios needed to resize the ROI coordinates to match the original frame
-		x_ratio = camera.frontend_ratio[0]* camera.prepare_ratio[0]
-		y_ratio = camera.frontend_ratio[1]* camera.prepare_ratio[1]
-
-		self.ROI = []
+	def crop_frame(self, frame):
+		"""
+			return the part of the frame inference runs on and its (x, y) offset in the frame
+			when cropping to the ROI, this is a view of the padded bounding rectangle of the ROI, so small vehicles keep more pixels at the network input
+		"""
+		if not self.crop_to_roi or self.prepared_roi is None:
+			return frame, (0, 0)
 
-		for coord in camera.ROI:
-			self.ROI.append([coord[0]/x_ratio,coord[1]/y_ratio])
+		(H,W) = frame.shape[:2]
+		x0, y0, x1, y1 = self.prepared_roi.padded_bounds(self.crop_padding, W, H)
+		return frame[y0:y1, x0:x1], (x0, y0)
 
 	def get_yolo_labels(self):
 		"""
@@ -65,10 +112,9 @@ class YoloVideo:
 	def get_layer_names(self):
 		"""
 			determine only the *output* layer names that we need from YOLO
-			returns layer names
+			returns layer names, resolved once by the session
 		"""
-		ln = self.net.getLayerNames()
-		return [ln[i[0] - 1] for i in self.net.getUnconnectedOutLayers()]
+		return self.session.layer_names
 
 	def detect_in_frame(self, output_time=False):
 		"""
@@ -76,65 +122,91 @@ class YoloVideo:
 			returns layer outputs, which contains class id and confidence probabilities
 		"""
 
-		#get yolo object and layer names
-		#self.net = self.get_yolo_object()
-		ln = self.get_layer_names()
-
 		# construct a blob from the input frame and then perform a forward
 		# pass of the YOLO object detector, giving us our bounding boxes
 		# and associated probabilities
-		blob = cv2.dnn.blobFromImage(self.frame, 1 / 255.0, (416, 416),swapRB=True, crop=False)
-		self.net.setInput(blob)
-		start = time.time()
-		layerOutputs = self.net.forward(ln)
-		end = time.time()
+		start = time.perf_counter()
+		blob = self.session.set_input([self.inference_frame])
+		preprocessed = time.perf_counter()
+		layerOutputs = self.session.forward(blob)
+		end = time.perf_counter()
+		self.stage_times["preprocess"] = preprocessed - start
+		self.stage_times["forward"] = end - preprocessed
 		if output_time == True:
-			elap = (end - start)
+			elap = (end - preprocessed)
 			print("[INFO] single frame took {:.4f} seconds".format(elap))
 		return layerOutputs
 
-	def extract_detection_information(self):
+	def detect_in_frames(self, frames, output_time=False):
 		"""
-			returns lists of detected bounding boxes, confidences, and class IDs, respectively
+			detect vehicles in several frames with a single forward pass, frames are the inference frames of each camera
+			returns a list with the layer outputs of each frame, in the same order as frames
 		"""
+		start = time.perf_counter()
+		blob = self.session.set_input(frames)
+		preprocessed = time.perf_counter()
+		layerOutputs = self.session.forward(blob)
+		end = time.perf_counter()
+		# Every frame is charged its share of the batch, so per-camera latencies do not grow with the batch size
+		self.stage_times["preprocess"] = (preprocessed - start) / len(frames)
+		self.stage_times["forward"] = (end - preprocessed) / len(frames)
+		if output_time == True:
+			elap = (end - preprocessed)
+			print("[INFO] batch of {} frames took {:.4f} seconds".format(len(frames), elap))
 
-		# initialize our lists of detected bounding boxes, confidences,and class IDs, respectively
-		boxes = []
-		confidences= []
-		classIDs = []
-		layerOutputs = self.detect_in_frame()
+		# Depending on the OpenCV version, YOLO layers return either (batch, rows, values)
+		# or (batch * rows, values) with the rows of each frame stored one after the other
+		frameOutputs = [[] for _ in frames]
+		for output in layerOutputs:
+			output = output.reshape(len(frames), -1, output.shape[-1])
+			for i in range(len(frames)):
+				frameOutputs[i].append(output[i])
 
-		#grab frame dimensions
-		(H,W) = self.frame.shape[:2]
+		return frameOutputs
 
-		# loop over each of the layer outputs
-		for output in layerOutputs:
-			# loop over each of the detections
-			for detection in output:
-				# extract the class ID and confidence (i.e., probability) of the current object detection
-				scores = detection[5:]
-				classID = np.argmax(scores)
-				score_confidence = scores[classID]
-
-				# filter out weak predictions by ensuring the detected
-				# probability is greater than the minimum probability
-				if score_confidence > self.confidence:
-					# scale the bounding box coordinates back relative to
-					# the size of the image, keeping in mind that YOLO height
-					box = detection[0:4] * np.array([W, H, W, H])
-					(centerX, centerY, width, height) = box.astype("int")
-
-					# use the center (x, y)-coordinates to derive the top
-					# and and left corner of the bounding box
-					x = int(centerX - (width / 2))
-					y = int(centerY - (height / 2))
-
-					# update our list of bounding box coordinates,confidences and class IDs
-					boxes.append([x, y, int(width), int(height)])
-					confidences.append(float(score_confidence))
-					classIDs.append(classID)
+	def extract_detection_information(self, layerOutputs=None):
+		"""
+			returns arrays of detected bounding boxes, confidences, and class IDs, respectively
+			layerOutputs: outputs already computed for self.frame, runs detect_in_frame when None
+		"""
+		if layerOutputs is None:
+			layerOutputs = self.detect_in_frame()
+		start = time.perf_counter()
+
+		#grab dimensions of the frame inference ran on
+		(H,W) = self.inference_frame.shape[:2]
+
+		# stack the detections of every output layer, one row per detection
+		detections = np.concatenate([output.reshape(-1, output.shape[-1]) for output in layerOutputs])
+
+		# extract the class ID and confidence (i.e., probability) of every detection
+		scores = detections[:, 5:]
+		classIDs = np.argmax(scores, axis=1)
+		score_confidences = scores[np.arange(len(scores)), classIDs]
+
+		# filter out weak predictions by ensuring the detected
+		# probability is greater than the minimum probability
+		keep = score_confidences > self.confidence
+		detections = detections[keep]
+		classIDs = classIDs[keep]
+		score_confidences = score_confidences[keep]
+
+		# scale the bounding box coordinates back relative to
+		# the size of the image, keeping in mind that YOLO height
+		box = (detections[:, 0:4] * np.array([W, H, W, H])).astype("int")
+		(centerX, centerY, width, height) = box.T
+
+		# use the center (x, y)-coordinates to derive the top
+		# and and left corner of the bounding boxes, moved back
+		# into the full frame when inference ran on a crop
+		x = (centerX - (width / 2)).astype("int") + self.crop_offset[0]
+		y = (centerY - (height / 2)).astype("int") + self.crop_offset[1]
+
+		boxes = np.stack([x, y, width, height], axis=1).astype(np.int32)
+		confidences = score_confidences.astype(np.float32)
 
 		self.detection_info = (boxes,confidences,classIDs)
+		self.stage_times["decode"] = time.perf_counter() - start
 
 	def apply_suppression(self):
 		"""
@@ -143,16 +215,43 @@ class YoloVideo:
 		boxes = self.detection_info[0]
 		confidences = self.detection_info[1]
 
+		start = time.perf_counter()
 		idxs = cv2.dnn.NMSBoxes(boxes, confidences, self.confidence, self.threshold)
+		self.stage_times["nms"] = time.perf_counter() - start
 		return idxs
 
-	def detect_intersections(self):
+	def detect_intersections_batch(self, frames, cameras):
+		"""
+			runs detection on several frames at once, frames[i] comes from cameras[i]
+			returns a list with the (carAmount, debug image) of each frame, their VehicleDetections and stage times are kept
+			in self.batch_vehicle_detections and self.batch_stage_times
+		"""
+		crops = []
+		for frame, camera in zip(frames, cameras):
+			self.set_frame_and_roi(frame, camera)
+			crops.append(self.inference_frame)
+		frameOutputs = self.detect_in_frames(crops)
+		batch_times = self.stage_times
+
+		results = []
+		self.batch_vehicle_detections = []
+		self.batch_stage_times = []
+		for frame, camera, output in zip(frames, cameras, frameOutputs):
+			self.set_frame_and_roi(frame, camera)
+			self.stage_times.update(batch_times)
+			results.append(self.detect_intersections(output))
+			self.batch_vehicle_detections.append(self.vehicle_detections)
+			self.batch_stage_times.append(self.stage_times)
+		return results
+
+	def detect_intersections(self, layerOutputs=None):
 		"""
 			detects if the detected vehicle is within the ROI
 			self.net: yolo object
+			layerOutputs: outputs already computed for self.frame, runs detection when None
 		"""
 
-		self.extract_detection_information()
+		self.extract_detection_information(layerOutputs)
 
 		idxs = self.apply_suppression()
 		LABELS = self.labels
@@ -160,49 +259,66 @@ class YoloVideo:
 		confidences = self.detection_info[1]
 		classIDs = self.detection_info[2]
 		
-		trackObj = None
+		lane_names = self.prepared_roi.lane_names
+		self.vehicle_detections = VehicleDetections(NO_VEHICLES.boxes, NO_VEHICLES.accepted,
+			np.zeros((len(lane_names), 0), dtype=bool), lane_names)
 		
 		if self.debug:
+			start = time.perf_counter()
 			self.draw_debug_setup()
+			self.stage_times["debug"] = time.perf_counter() - start
 
 		#ensure at least one detection exists
 		if len(idxs) > 0:
-			#loop over indexes we are keeping
-			carAmount = 0
-			for i in idxs.flatten():
-				#extract the bounding box coordinates
-				(x, y) = (boxes[i][0], boxes[i][1])
-				(w, h) = (boxes[i][2], boxes[i][3])
-
-				#get shape of bounding box to get intersection with ROI
-				bounding_box = [(x,y),(x,y+h),(x+w,y+h),(x+w,y),(x,y)]		
-						
-				bbox_class = LABELS.get(classIDs[i], classIDs[i])
-				
-				intersects_flag = False
-				
-				if bbox_class in self.pickedClass:
-					intersects_flag = intersection_of_polygons(self.ROI,bounding_box)
-					if intersects_flag:
-						carAmount += 1
-						
-						#print(f"DETECTED: {LABELS.get(classIDs[i], classIDs[i])}, CONFIDENCE: {confidences[i]}")
-						#print("Intersection with ROI: TRUE")
-				
-				if self.debug:
+			idxs = np.asarray(idxs).flatten()
+			bbox_classes = [LABELS.get(classIDs[i], classIDs[i]) for i in idxs]
+
+			#evaluate every kept vehicle box against every lane in one pass
+			picked = np.array([bbox_class in self.pickedClass for bbox_class in bbox_classes], dtype=bool)
+			lanes = np.zeros((len(lane_names), len(idxs)), dtype=bool)
+			start = time.perf_counter()
+			if picked.any():
+				lanes[:, picked] = self.prepared_roi.evaluate_lanes(np.asarray(boxes).reshape(-1, 4)[idxs[picked]])
+			intersects_flags = lanes.any(axis=0)
+			self.stage_times["roi"] = time.perf_counter() - start
+
+			carAmount = int(intersects_flags.sum())
+			self.vehicle_detections = VehicleDetections(np.asarray(boxes).reshape(-1, 4)[idxs[picked]], intersects_flags[picked],
+				lanes[:, picked], lane_names)
+
+			if self.debug:
+				start = time.perf_counter()
+				#loop over indexes we are keeping
+				for i, bbox_class, intersects_flag in zip(idxs, bbox_classes, intersects_flags):
+					#extract the bounding box coordinates
+					(x, y) = (int(boxes[i][0]), int(boxes[i][1]))
+					(w, h) = (int(boxes[i][2]), int(boxes[i][3]))
+
 					self.draw_debug_bbox([x, y, w, h], intersects_flag, bbox_class, confidences[i])
-            			
+				self.stage_times["debug"] += time.perf_counter() - start
+
 			return carAmount, self.DEBUG_IMAGE
 		return 0, self.DEBUG_IMAGE 
 	
 	def draw_debug_setup(self): #draw ROI and setup text
-		self.DEBUG_IMAGE = self.frame
+		# Draw on a copy, the original frame is still being streamed to the frontend
+		self.DEBUG_IMAGE = self.frame.copy()
 			
 		cv2.putText(self.DEBUG_IMAGE, text=f"DETECTION MODE", 
 					org=(int(self.DEBUG_IMAGE.shape[1]*0.75), 40), fontFace=cv2.FONT_HERSHEY_SIMPLEX, 
 					fontScale=1, color=(150,255,255), thickness=2, lineType=cv2.LINE_AA)	
 			
-		cv2.polylines(self.DEBUG_IMAGE, [np.asarray(self.ROI, np.int32).reshape((-1,1,2))], True, (150,255,255), 3)
+		for lane in self.prepared_roi.lanes:
+			points = np.asarray(lane.coordinates, np.int32).reshape((-1,1,2))
+			cv2.polylines(self.DEBUG_IMAGE, [points], True, (150,255,255), 3)
+			if len(self.prepared_roi.lanes) > 1:
+				cv2.putText(self.DEBUG_IMAGE, text=str(lane.name), org=(int(points[0, 0, 0]), int(points[0, 0, 1])), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+							fontScale=0.7, color=(150,255,255), thickness=2, lineType=cv2.LINE_AA)
+
+		if self.inference_frame is not self.frame:
+			(h,w) = self.inference_frame.shape[:2]
+			(x,y) = self.crop_offset
+			cv2.rectangle(self.DEBUG_IMAGE, (x, y), (x+w, y+h), (150,150,150), 1)
 	
 	
 	def draw_debug_bbox(self, bbox, intersects_flag, bbox_class, confidence):
@@ -0,0 +1,137 @@
+# Python-specific imports
+import asyncio
+from urllib.parse import parse_qs
+
+# Frame rate a viewer gets when it does not ask for one with ?fps=
+DEFAULT_VIEWER_FPS = 15.0
+
+class StreamingApp:
+	"""
+		ASGI application serving /stream_feed and /debug_feed as coroutines that await new-frame notifications from
+		the camera FrameHubs, so an open stream costs no thread. Every other route is served by the Flask app.
+		wsgi_app: Flask app serving the page and the control routes
+		service: DetectionService holding the FrameHubs of every camera
+		get_current_camera: callable returning the name of the camera currently shown on the frontend
+		max_viewers: maximum number of open streams, further viewers get a 503
+		max_fps: upper bound on the frame rate a viewer can ask for
+	"""
+
+	def __init__(self, wsgi_app, service, get_current_camera, max_viewers=64, max_fps=30.0):
+		"""
+			Wraps the Flask app so it can be served by an ASGI server.
+		"""
+		# asgiref is only needed when serving with an ASGI server
+		from asgiref.wsgi import WsgiToAsgi
+
+		self.wsgi_app = WsgiToAsgi(wsgi_app)
+		self.service = service
+		self.get_current_camera = get_current_camera
+		self.max_viewers = max_viewers
+		self.max_fps = max_fps
+		self.viewers = 0
+
+	async def __call__(self, scope, receive, send):
+		"""
+			Routes a request to a stream coroutine or to the Flask app.
+		"""
+		if scope["type"] == "http" and scope["path"] in ("/stream_feed", "/debug_feed"):
+			camera_name = self.get_current_camera()
+			if scope["path"] == "/stream_feed":
+				hub = self.service.stream_hub(camera_name)
+			else:
+				hub = self.service.debug_hub(camera_name)
+
+			await self.stream(scope, receive, send, hub)
+		else:
+			await self.wsgi_app(scope, receive, send)
+
+	def viewer_fps(self, scope):
+		"""
+			Frame rate asked for by the viewer with ?fps=, capped to max_fps.
+		"""
+		query = parse_qs(scope.get("query_string", b"").decode())
+		try:
+			fps = float(query["fps"][0])
+		except (KeyError, ValueError):
+			fps = DEFAULT_VIEWER_FPS
+		return min(max(fps, 0.1), self.max_fps)
+
+	async def stream(self, scope, receive, send, hub):
+		"""
+			Sends every new encoded frame of the hub to one viewer as multipart/x-mixed-replace, at most at the viewer's frame rate.
+		"""
+		if hub is None or self.viewers >= self.max_viewers:
+			await self.reject(send, 404 if hub is None else 503)
+			return
+
+		loop = asyncio.get_running_loop()
+		interval = 1.0 / self.viewer_fps(scope)
+		new_frame = asyncio.Event()
+		disconnected = asyncio.Event()
+
+		def notify():
+			loop.call_soon_threadsafe(new_frame.set)
+
+		async def watch_disconnect():
+			while True:
+				message = await receive()
+				if message["type"] == "http.disconnect":
+					disconnected.set()
+					new_frame.set()
+					return
+
+		self.viewers += 1
+		hub.add_listener(notify)
+		watcher = asyncio.ensure_future(watch_disconnect())
+
+		try:
+			await send({
+				"type": "http.response.start",
+				"status": 200,
+				"headers": [(b"content-type", b"multipart/x-mixed-replace; boundary=frame")],
+			})
+
+			last_id = 0
+			next_send = 0.0
+			while not disconnected.is_set():
+				# Wait for a frame this viewer has not seen yet
+				new_frame.clear()
+				if hub.frame_id == last_id:
+					await new_frame.wait()
+					continue
+
+				# Respect the viewer's frame rate, frames published meanwhile are skipped
+				delay = next_send - loop.time()
+				if delay > 0:
+					await asyncio.sleep(delay)
+
+				# Encoding is CPU work, keep it off the event loop
+				frame_id, encoded = await loop.run_in_executor(None, hub.latest)
+				if encoded is None or frame_id == last_id:
+					continue
+
+				await send({"type": "http.response.body", "body": encoded, "more_body": True})
+				last_id = frame_id
+				next_send = loop.time() + interval
+		except OSError:
+			pass
+		finally:
+			watcher.cancel()
+			hub.remove_listener(notify)
+			self.viewers -= 1
+
+	async def reject(self, send, status):
+		"""
+			Answers a stream request that cannot be served.
+		"""
+		await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+		await send({"type": "http.response.body", "body": b"Too many viewers" if status == 503 else b"Unknown camera"})
+
+def run_asgi(wsgi_app, service, get_current_camera, host="0.0.0.0", port=5000, max_viewers=64, max_fps=30.0):
+	"""
+		Serves the app with uvicorn, streams are coroutines instead of threads.
+	"""
+	import uvicorn
+
+	app = StreamingApp(wsgi_app, service, get_current_camera, max_viewers=max_viewers, max_fps=max_fps)
+	uvicorn.run(app, host=host, port=port, log_level="warning")
@@ -0,0 +1,400 @@
+"""
+	Headless benchmark of the detection pipeline, runs without Flask, model weights or a TPU.
+	The networks are replaced by stand-ins producing outputs of the right shape, so the numbers measure
+	everything around the forward pass: preprocessing, decoding, nms, ROI geometry and debug rendering.
+
+	Run from the repository root, the label and anchor files are read from models/:
+	python benchmark.py --frames 200 --output logs/benchmark_results.json
+	python benchmark.py --clip ./inputVideos/video1.mp4
+"""
+
+# Python-specific imports
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+# Package-specific imports
+from find_intersect import PreparedROI, intersection_of_polygons
+from model_session import DnnSession, TfliteSession
+from tpu_utils_tiny_yolo import benchmark_nms, featuresToBoxes, get_anchors
+from YoloVideo import YoloVideo
+
+# Class ids of car in coco_labels.txt (mobilenet, dnn) and coco.names (tiny-yolo)
+CAR_CLASS = 2
+
+class FakeDnnNet:
+	"""
+		Stands in for a tiny-yolo network from cv2.dnn.readNetFromDarknet. forward() returns two YOLO heads of
+		random low scores with a few confident cars moving across the frame.
+		input_size: network input size the heads are sized for
+		cars: number of confident car rows per frame
+		forward_ms: milliseconds slept in forward() to simulate the network
+	"""
+
+	def __init__(self, input_size=416, cars=4, forward_ms=0.0, seed=0):
+		self.rows = [(input_size // 32) ** 2 * 3, (input_size // 16) ** 2 * 3]
+		self.cars = cars
+		self.forward_ms = forward_ms
+		self.random = np.random.RandomState(seed)
+		self.calls = 0
+		self.batch = 1
+
+	def getLayerNames(self):
+		return ["conv", "yolo_16", "yolo_23"]
+
+	def getUnconnectedOutLayers(self):
+		return np.array([2, 3])
+
+	def setInput(self, blob):
+		self.batch = blob.shape[0]
+
+	def forward(self, names):
+		if self.forward_ms:
+			time.sleep(self.forward_ms / 1000.0)
+
+		outputs = []
+		for rows in self.rows:
+			output = self.random.uniform(0, 0.05, (self.batch * rows, 85)).astype(np.float32)
+			output[:, :4] = self.random.uniform(0.05, 0.95, (self.batch * rows, 4))
+			for b in range(self.batch):
+				for car in range(self.cars):
+					row = output[b * rows + car * (rows // self.cars)]
+					row[0] = ((self.calls + car * 40) % 100) / 100.0
+					row[1] = 0.3 + 0.1 * car
+					row[2:4] = (0.12, 0.1)
+					row[4] = 0.9
+					row[5 + CAR_CLASS] = 0.9
+			outputs.append(output)
+
+		self.calls += 1
+		return outputs
+
+class FakeInterpreter:
+	"""
+		Stands in for a tflite interpreter of tpu-tiny-yolov3 or tpu-mobilenetv2, with quantized uint8 outputs of the right shapes.
+		invoke_ms: milliseconds slept in invoke() to simulate the TPU
+	"""
+
+	def __init__(self, modelType, input_size=416, invoke_ms=0.0, seed=0):
+		self.modelType = modelType
+		self.invoke_ms = invoke_ms
+		self.random = np.random.RandomState(seed)
+		self.tensors = {0: np.zeros((1, input_size, input_size, 3), dtype=np.uint8)}
+		self.inputs = [{"index": 0, "shape": np.array([1, input_size, input_size, 3]), "dtype": np.uint8, "quantization": (0.0, 0)}]
+
+		if modelType == "tpu-tiny-yolov3":
+			shapes = [(1, input_size // 32, input_size // 32, 255), (1, input_size // 16, input_size // 16, 255)]
+			quantization = (0.1, 128)
+		else:
+			shapes = [(1, 10, 4), (1, 10), (1, 10), (1,)]
+			quantization = (0.0, 0)
+
+		self.outputs = []
+		for i, shape in enumerate(shapes):
+			self.tensors[i + 1] = np.zeros(shape, dtype=np.uint8 if modelType == "tpu-tiny-yolov3" else np.float32)
+			self.outputs.append({"index": i + 1, "shape": np.array(shape), "quantization": quantization})
+
+	def allocate_tensors(self):
+		pass
+
+	def get_input_details(self):
+		return self.inputs
+
+	def get_output_details(self):
+		return self.outputs
+
+	def tensor(self, index):
+		return lambda: self.tensors[index]
+
+	def get_tensor(self, index):
+		return self.tensors[index].copy()
+
+	def invoke(self):
+		if self.invoke_ms:
+			time.sleep(self.invoke_ms / 1000.0)
+
+		if self.modelType == "tpu-tiny-yolov3":
+			for detail in self.outputs:
+				# Low objectness everywhere except a few cells in the middle row holding an anchor sized car,
+				# 128 is the zero point so the box offsets dequantize to 0
+				tensor = self.tensors[detail["index"]]
+				tensor[...] = self.random.randint(0, 100, tensor.shape)
+				rows, cols = tensor.shape[1:3]
+				for cell in range(3):
+					car = tensor[0, rows // 2, cols // 4 + cell * (cols // 6)]
+					car[0:4] = 128
+					car[4] = 255
+					car[5 + CAR_CLASS] = 255
+		else:
+			count = 4
+			boxes = self.tensors[1][0]
+			boxes[:count] = [[0.3, 0.1 + 0.2 * i, 0.4, 0.25 + 0.2 * i] for i in range(count)]
+			self.tensors[2][0][:count] = CAR_CLASS
+			self.tensors[3][0][:count] = self.random.uniform(0.5, 1.0, count)
+			self.tensors[4][0] = count
+
+class FakeCamera:
+	"""
+		Holds the ROI of a benchmark run like a Camera does.
+	"""
+
+	def __init__(self, width, height):
+		self.prepared_roi = PreparedROI([[width * 0.2, height * 0.3], [width * 0.8, height * 0.3],
+										[width * 0.9, height * 0.7], [width * 0.1, height * 0.7]])
+
+	def get_prepared_roi(self):
+		return self.prepared_roi
+
+def synthetic_frames(count, width, height, seed=0):
+	"""
+		Returns count frames of noise with bright rectangles moving across them.
+	"""
+	random = np.random.RandomState(seed)
+	background = random.randint(0, 80, (height, width, 3)).astype(np.uint8)
+	frames = []
+	for i in range(count):
+		frame = background.copy()
+		for car in range(3):
+			x = (i * 7 + car * width // 3) % width
+			y = int(height * (0.35 + 0.1 * car))
+			cv2.rectangle(frame, (x, y), (x + width // 10, y + height // 12), (200, 200, 255), -1)
+		frames.append(frame)
+	return frames
+
+def clip_frames(path, count):
+	"""
+		Decodes count frames of a recorded clip through Video, in batch mode so no frame is skipped.
+		returns the frames and the decode fps
+	"""
+	from video import Video
+
+	video = Video(path, policy="batch")
+	frames_iter = iter(video)
+	start = time.perf_counter()
+	frames = [next(frames_iter) for _ in range(count)]
+	elapsed = time.perf_counter() - start
+	video.stop_video_stream()
+	return frames, count / elapsed
+
+def summarize(samples):
+	"""
+		Returns mean and percentiles in milliseconds of a list of durations in seconds.
+	"""
+	samples = np.asarray(samples) * 1000.0
+	if len(samples) == 0:
+		return {}
+	return {
+		"mean_ms": float(samples.mean()),
+		"p50_ms": float(np.percentile(samples, 50)),
+		"p90_ms": float(np.percentile(samples, 90)),
+		"p99_ms": float(np.percentile(samples, 99)),
+		"max_ms": float(samples.max()),
+	}
+
+def measure(function):
+	"""
+		Runs function and returns its result and wall time. Memory is measured by peak_memory in a separate run,
+		tracing every allocation would slow the timed run down.
+	"""
+	start = time.perf_counter()
+	result = function()
+	return result, time.perf_counter() - start
+
+def peak_memory(function):
+	"""
+		Runs function with allocations traced and returns its peak traced memory in megabytes.
+	"""
+	tracemalloc.start()
+	try:
+		function()
+		return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+	finally:
+		tracemalloc.stop()
+
+def run_detector(detector, frames, batch_size=1):
+	"""
+		Runs detection on every frame like the detection service does and returns per-stage latencies, fps and peak memory.
+	"""
+	height, width = frames[0].shape[:2]
+	camera = FakeCamera(width, height)
+	stage_samples = {}
+	totals = []
+	cars = 0
+
+	def run(record=True):
+		nonlocal cars
+		for i in range(0, len(frames), batch_size):
+			chunk = frames[i:i + batch_size]
+			start = time.perf_counter()
+			if len(chunk) == 1:
+				detector.set_frame_and_roi(chunk[0], camera)
+				results = [detector.detect_intersections()]
+				times = [detector.stage_times]
+			else:
+				results = detector.detect_intersections_batch(chunk, [camera] * len(chunk))
+				times = detector.batch_stage_times
+			elapsed = time.perf_counter() - start
+			if not record:
+				continue
+
+			for (num_cars, _), frame_times in zip(results, times):
+				cars += num_cars
+				totals.append(elapsed / len(chunk))
+				for stage, seconds in frame_times.items():
+					stage_samples.setdefault(stage, []).append(seconds)
+
+	_, elapsed = measure(run)
+	peak = peak_memory(lambda: run(record=False))
+	return {
+		"frames": len(frames),
+		"fps": len(frames) / elapsed,
+		"peak_memory_mb": peak,
+		"cars_counted": cars,
+		"total": summarize(totals),
+		"stages": {stage: summarize(samples) for stage, samples in stage_samples.items()},
+	}
+
+def run_geometry(boxes=200, repeats=20, seed=0):
+	"""
+		Times PreparedROI.evaluate against intersection_of_polygons on the same random boxes.
+	"""
+	random = np.random.RandomState(seed)
+	camera = FakeCamera(1920, 1080)
+	xy = random.uniform(0, 1800, (boxes, 2))
+	wh = random.uniform(20, 300, (boxes, 2))
+	box_array = np.hstack([xy, wh])
+
+	vectorized = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		camera.prepared_roi.evaluate(box_array)
+		vectorized.append(time.perf_counter() - start)
+
+	start = time.perf_counter()
+	for x, y, w, h in box_array:
+		intersection_of_polygons(camera.prepared_roi.coordinates, [[x, y], [x + w, y], [x + w, y + h], [x, y + h]])
+	per_box = time.perf_counter() - start
+
+	return {"boxes": boxes, "prepared_roi": summarize(vectorized), "intersection_of_polygons_ms": per_box * 1000.0}
+
+def check_decode():
+	"""
+		Checks that featuresToBoxes undoes the letterbox of TfliteSession.set_input, for landscape frames padded above and
+		below and portrait frames padded left and right. A single confident prediction is placed in the centre cell.
+		returns the largest error in pixels
+	"""
+	anchors = get_anchors("models/tiny_yolo_anchors.txt")[[1, 2, 3]]
+	head = np.full((1, 26, 26, 3, 85), -20.0, dtype=np.float32)
+	head[0, 13, 13, 0, :4] = 0.0
+	head[0, 13, 13, 0, 4:6] = 20.0
+	head = head.reshape(1, 26, 26, 255)
+
+	worst = 0.0
+	for frame_shape in ((1080, 1920, 3), (800, 400, 3)):
+		boxes, _, _ = featuresToBoxes(head, anchors, 80, (1, 416, 416, 3), frame_shape, 0.5)
+
+		# Where the centre of the network input lands in the frame, the same way set_input places the frame
+		height, width = frame_shape[:2]
+		scale = min(416 / width, 416 / height)
+		dx, dy = (416 - int(width * scale)) // 2, (416 - int(height * scale)) // 2
+		expected = np.array([(216 - dx) / scale, (216 - dy) / scale])
+		error = float(np.abs(boxes[0].mean(axis=0) - expected).max())
+		if error > 0.5:
+			raise AssertionError("featuresToBoxes is off by {:.1f}px on a {}x{} frame".format(error, width, height))
+		worst = max(worst, error)
+	return worst
+
+def run_decode(repeats=50, seed=0):
+	"""
+		Times featuresToBoxes on a random tiny-yolo head.
+	"""
+	random = np.random.RandomState(seed)
+	anchors = get_anchors("models/tiny_yolo_anchors.txt")
+	head = random.uniform(-3, 3, (1, 26, 26, 255)).astype(np.float32)
+	samples = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		featuresToBoxes(head, anchors[[1, 2, 3]], 80, (1, 416, 416, 3), (1080, 1920, 3), 0.2)
+		samples.append(time.perf_counter() - start)
+	return summarize(samples)
+
+def git_commit():
+	"""
+		Returns the commit being benchmarked, or None outside of a git checkout.
+	"""
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def __parseArguments():
+	parser = argparse.ArgumentParser("Headless detection pipeline benchmark")
+	parser.add_argument("--frames", type=int, default=200, help="Number of frames run through each detector")
+	parser.add_argument("--width", type=int, default=1280, help="Width of the synthetic frames")
+	parser.add_argument("--height", type=int, default=720, help="Height of the synthetic frames")
+	parser.add_argument("--clip", default=None, help="Recorded clip to decode with Video and run instead of synthetic frames")
+	parser.add_argument("--batch_size", type=int, default=1, help="Frames per forward pass of the cpu detector")
+	parser.add_argument("--forward_ms", type=float, default=0.0, help="Milliseconds the stand-in networks sleep per forward pass")
+	parser.add_argument("--crop_to_roi", action="store_true", help="Benchmark the ROI-cropped inference mode")
+	parser.add_argument("--output", default="logs/benchmark_results.json", help="JSON file the results are written to")
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	args = __parseArguments()
+	results = {
+		"commit": git_commit(),
+		"timestamp": time.time(),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"opencv": cv2.__version__,
+		"args": vars(args),
+	}
+
+	if args.clip:
+		frames, decode_fps = clip_frames(args.clip, args.frames)
+		results["video_decode_fps"] = decode_fps
+	else:
+		frames = synthetic_frames(args.frames, args.width, args.height)
+
+	print("[INFO] cpu-tiny-yolov3 stand-in")
+	detector = YoloVideo(DnnSession(FakeDnnNet(forward_ms=args.forward_ms)), crop_to_roi=args.crop_to_roi)
+	results["cpu-tiny-yolov3"] = run_detector(detector, frames, args.batch_size)
+
+	for modelType in ("tpu-tiny-yolov3", "tpu-mobilenetv2"):
+		print("[INFO] {} stand-in".format(modelType))
+		try:
+			from tpuVideo import tpuVideo
+		except ImportError as e:
+			results[modelType] = {"skipped": str(e)}
+			continue
+		session = TfliteSession(FakeInterpreter(modelType, invoke_ms=args.forward_ms), modelType)
+		detector = tpuVideo(session, modelType=modelType, crop_to_roi=args.crop_to_roi)
+		results[modelType] = run_detector(detector, frames)
+
+	print("[INFO] geometry, nms and decode helpers")
+	results["geometry"] = run_geometry()
+	results["nms_ms"] = benchmark_nms()
+	results["decode"] = run_decode()
+	results["decode_error_px"] = check_decode()
+
+	# ru_maxrss is in kilobytes on Linux and bytes on macOS
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	results["max_rss_mb"] = maxrss / (1024 * 1024) if platform.system() == "Darwin" else maxrss / 1024
+
+	directory = os.path.dirname(args.output)
+	if directory:
+		os.makedirs(directory, exist_ok=True)
+	with open(args.output, "w") as f:
+		json.dump(results, f, indent=2)
+
+	for name in ("cpu-tiny-yolov3", "tpu-tiny-yolov3", "tpu-mobilenetv2"):
+		if "fps" in results[name]:
+			print("[INFO] {}: {:.1f} fps, p90 {:.2f} ms".format(name, results[name]["fps"], results[name]["total"]["p90_ms"]))
+	print("[INFO] results written to {}".format(args.output))
@@ -1,27 +1,51 @@
 # Python-specific imports
+import threading
+import time
 from imutils.video import VideoStream
 
+# Package-specific imports
+from find_intersect import PreparedROI, PreparedROISet, DEFAULT_LANE
+from capture import CapturedFrame
+from stream_watchdog import StreamWatchdog
+
 class Camera:
 
 	"""
 		url: The camera url passed in
-		ROI: A list containing all of the coordinates of the Bounding Box.
+		ROI: A list containing all of the coordinates of the Bounding Box. With several lanes, the ROI of the default lane or else of the first one.
+		lanes: dictionary mapping lane names to the (ROI coordinates, threshold) of each lane, in frontend coordinates
 		VS: A VideoStream object that streams from the camera url
 		dimensions: A list containing the width and height of each frame we would receive.
 		prepare_ratio: A list containing the ratio of the original frame to the frame that's resized when the frame is preparing for it to be displayed.
 		frontend_ratio: A list containing the ratio of the original frame to the frame that's resized when the frame is displayed on the frontend.
 		car_count: number of cars that have passed by this camera
+		prepared_roi: PreparedROISet of the lanes scaled to the original frame, rebuilt when a lane or the resolution changes
+		seq: sequence number of the newest frame, only increases when the stream delivers a new frame
+		timestamp: time at which the newest frame was first seen
+		stall_timeout: seconds without a new frame after which the stream is considered stalled and reconnected
+		watchdog: StreamWatchdog reconnecting the stream in the background when it stalls
 	"""
 
-	def __init__(self, url):
+	def __init__(self, url, stall_timeout=5.0):
 		"""
 			Basic setup of the object, instanstiates url and starts a new video stream
 		"""
 		self.url = url
 		self.ROI = None
+		self.lanes = {}
+		self.prepared_roi = None
 		self.car_count = 0
+		self.seq = 0
+		self.timestamp = 0.0
+		self._last_frame = None
+		self._lock = threading.Lock()
+		# Guards the lanes and the PreparedROISet, so a set built from old lanes never replaces a newer invalidation
+		self._roi_lock = threading.Lock()
+		self.stall_timeout = stall_timeout
 		#self.frame_delay = 5
 		self.initialize_video_stream(url)
+		self.watchdog = StreamWatchdog(self)
+		self.watchdog.start()
 
 	def __iter__(self):
 		"""
@@ -35,16 +59,93 @@ class Camera:
 		"""
 		return 'URL: {}, ROI: {}'.format(self.url,self.ROI)
 
-	def set_roi_coordinates(self, coordinates):
+	def set_roi_coordinates(self, coordinates, lane=DEFAULT_LANE, thresh=0.7):
+		"""
+			Updates the Region of Interest(ROI) of a lane with the coordinates specified from the frontend.
+			lane: name of the lane, the frontend draws the default lane
+			thresh: 0.0-1.0 threshold used to vary acceptance whether a BBOX is within the lane or not
+		"""
+		with self._roi_lock:
+			self.lanes[lane] = (coordinates, thresh)
+			self.__update_roi()
+
+	def remove_lane(self, lane):
+		"""
+			Stops counting a lane.
+		"""
+		with self._roi_lock:
+			self.lanes.pop(lane, None)
+			self.__update_roi()
+
+	def __update_roi(self):
+		"""
+			Keeps ROI pointing at the default lane and drops the PreparedROISet so it is rebuilt, called with _roi_lock held.
+		"""
+		if DEFAULT_LANE in self.lanes:
+			self.ROI = self.lanes[DEFAULT_LANE][0]
+		else:
+			self.ROI = next(iter(self.lanes.values()))[0] if self.lanes else None
+		self.prepared_roi = None
+
+	def get_prepared_roi(self):
+		"""
+			Returns the lanes scaled from frontend coordinates to the original frame as a PreparedROISet.
+			The PreparedROISet is only rebuilt when a lane or the frame resolution changes.
+		"""
+		with self._roi_lock:
+			if self.ROI and self.prepared_roi is None:
+				# Ratios needed to resize the ROI coordinates to match the original frame
+				x_ratio = self.frontend_ratio[0]* self.prepare_ratio[0]
+				y_ratio = self.frontend_ratio[1]* self.prepare_ratio[1]
+
+				# An ROI assigned directly is the default lane
+				lanes = list(self.lanes.items()) or [(DEFAULT_LANE, (self.ROI, 0.7))]
+				self.prepared_roi = PreparedROISet([PreparedROI([[coord[0]/x_ratio, coord[1]/y_ratio] for coord in coordinates], thresh, name)
+					for name, (coordinates, thresh) in lanes])
+
+			return self.prepared_roi
+
+	def latest(self):
+		"""
+			Returns the newest frame of the stream as a CapturedFrame, frame is None if the stream never delivered one.
+			VideoStream keeps handing back the same array until the camera delivers a new one, so a frame is new when it is a different object.
+			While the stream is stalled or reconnecting the last good frame is returned, tagged as stale.
+		"""
+		with self._lock:
+			frame = self.VS.read()
+			if frame is not None and frame is not self._last_frame:
+				self._last_frame = frame
+				self.seq += 1
+				self.timestamp = time.time()
+			stale = self.watchdog.reconnecting or time.time() - max(self.timestamp, self.connected_at) > self.stall_timeout
+			return CapturedFrame(self.seq, self.timestamp, self._last_frame, stale)
+
+	def stalled(self):
 		"""
-			Updates Region of Interest(ROI) with the coordinates specified from the frontend.
+			Whether the stream delivered no new frame for stall_timeout seconds, checked by the watchdog.
 		"""
-		self.ROI = coordinates
+		self.latest()
+		return time.time() - max(self.timestamp, self.connected_at) > self.stall_timeout
+
+	def reconnect(self):
+		"""
+			Replaces the stream with a new one, raises if the new stream delivers no frame. Run by the watchdog.
+		"""
+		self.close_stream()
+		self.initialize_video_stream(self.url)
+
+	def connection_stats(self):
+		"""
+			Returns whether the stream is reconnecting, its reconnection counters and its total downtime in seconds.
+		"""
+		return self.watchdog.stats()
 
 	def build_video_stream(self, camera_url):
 		# Build Stream
 		self.VS = VideoStream(src=camera_url).start()
 		sample_frame = self.VS.read()
+		if sample_frame is None:
+			self.VS.stop()
 		return sample_frame
 
 	def initialize_video_stream(self,camera_url):
@@ -54,19 +155,31 @@ class Camera:
 
 		# If we are not able to read a proper frame from the stream, this will fail.
 		sample_frame = self.build_video_stream(camera_url)
-		assert sample_frame is not None
+		if sample_frame is None:
+			raise IOError("no frame from {}".format(camera_url))
+
+		self.connected_at = time.time()
 
 		# Set the width and height.
 		self.dimensions = sample_frame.shape
-		self.prepare_ratio = [800/self.dimensions[0],1]
-		self.frontend_ratio = [450/(self.dimensions[0]*self.prepare_ratio[0]),800/(self.dimensions[1]*self.prepare_ratio[1])]
+		with self._roi_lock:
+			self.prepare_ratio = [800/self.dimensions[0],1]
+			self.frontend_ratio = [450/(self.dimensions[0]*self.prepare_ratio[0]),800/(self.dimensions[1]*self.prepare_ratio[1])]
+			self.prepared_roi = None
 
-	def stop_video_stream(self):
+	def close_stream(self):
 		"""
-			Turns off the Video Stream
+			Stops the current stream, the watchdog keeps running.
 		"""
 		self.VS.stop()
 
+	def stop_video_stream(self):
+		"""
+			Turns off the Video Stream and its watchdog
+		"""
+		self.watchdog.stop()
+		self.close_stream()
+
 class CameraIterator:
 	"""
 		This object is created so that you can iterate through a camera object
@@ -77,24 +190,21 @@ class CameraIterator:
 			Basic setup of iterator object.
 		"""
 		self.camera = camera
+		self.last = None
+
+	def __iter__(self):
+		return self
 
 	def __next__(self):
 		"""
 			Allows iterating over this object to get each frame. Ex: "for frame in camera..."
+			The CapturedFrame of the returned frame is kept in last, its seq tells whether the frame is new.
 		"""
 
-		# If we are not able to read a proper frame from the stream, this will fail.
-		frame = self.camera.VS.read()
-	
-		restartCount = 0
-		while frame is None:
-			if restartCount == 5:
-				raise Exception("Frame is None")
-			self.camera.initialize_video_stream(self.camera.url())
-			frame = self.camera.VS.read()
-			restartCount+=1
-		
-		return frame
+		# A broken stream is reconnected by the camera's watchdog, meanwhile the last good frame comes back tagged as stale
+		captured = self.camera.latest()
+		self.last = captured
+		return captured.frame
 
 		
 """
@@ -0,0 +1,230 @@
+# Python-specific imports
+import threading
+import time
+
+# Package-specific imports
+from stream_watchdog import Backoff
+
+# States of a camera
+CONNECTING = "connecting"
+LIVE = "live"
+DEGRADED = "degraded"
+FAILED = "failed"
+
+class CameraStatus:
+	"""
+		Bring-up state of one camera.
+		name: key of the camera in the camera dictionary
+		state: connecting, live or failed, a live camera whose frames stopped or that is reconnecting is reported as degraded
+		error: why the camera failed, None otherwise
+		started_at: time the connection attempt started
+		changed_at: time of the last change of state
+		connect_seconds: seconds the connection took, None until it is live
+		attempts: number of connection attempts
+		retry_at: time of the next attempt of a failed camera, None otherwise
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.state = CONNECTING
+		self.error = None
+		self.started_at = time.time()
+		self.changed_at = self.started_at
+		self.connect_seconds = None
+		self.attempts = 0
+		self.retry_at = None
+
+	def set_state(self, state, error=None):
+		self.state = state
+		self.error = error
+		self.changed_at = time.time()
+
+class CameraBringup:
+	"""
+		Opens cameras concurrently, each on its own thread, so one unreachable stream neither blocks the others nor the app.
+		Opening a stream cannot be interrupted, a camera that is not open after connect_timeout is marked failed, gives its
+		connection slot to the next camera and is stopped if it still opens later. Every camera that opens in time is handed
+		to on_ready right away, failed cameras are retried with a Backoff until they open or are removed.
+		on_ready: callback(name, camera) run on the bring-up thread once a camera is open
+		connect_timeout: seconds a camera may take to deliver its first frame
+		max_concurrent: maximum number of cameras connecting at once
+		stall_after: seconds without a new frame after which a live camera is reported as degraded
+		retry_backoff: seconds before the first retry of a failed camera, doubled after every failed retry up to max_retry_backoff
+	"""
+
+	def __init__(self, on_ready, connect_timeout=10.0, max_concurrent=32, stall_after=5.0, retry_backoff=1.0, max_retry_backoff=60.0):
+		"""
+			Basic setup, nothing is opened until add().
+		"""
+		self.on_ready = on_ready
+		self.connect_timeout = connect_timeout
+		self.stall_after = stall_after
+		self.retry_backoff = retry_backoff
+		self.max_retry_backoff = max_retry_backoff
+		self.statuses = {}
+		self._slots = threading.BoundedSemaphore(max_concurrent)
+		self._lock = threading.Condition()
+
+	def add(self, name, open_camera):
+		"""
+			Starts opening a camera in the background. Does nothing if the camera is already connecting or live.
+			open_camera: callable returning the open Camera or Video, raising if the stream cannot be read
+		"""
+		with self._lock:
+			status = self.statuses.get(name)
+			if status is not None and status.state != FAILED:
+				return status
+			status = self.statuses[name] = CameraStatus(name)
+			status.attempts = 1
+
+		backoff = Backoff(self.retry_backoff, self.max_retry_backoff)
+		threading.Thread(target=self.__connect, args=(status, open_camera, backoff, 1), daemon=True).start()
+		return status
+
+	def remove(self, name):
+		"""
+			Forgets a camera, a connection still in progress is stopped once it opens.
+		"""
+		with self._lock:
+			status = self.statuses.pop(name, None)
+			if status is not None and status.state == CONNECTING:
+				status.set_state(FAILED, "removed")
+			self._lock.notify_all()
+
+	def wait(self, timeout=None):
+		"""
+			Waits until no camera is connecting anymore. returns False on timeout.
+		"""
+		with self._lock:
+			return self._lock.wait_for(lambda: all(s.state != CONNECTING for s in self.statuses.values()), timeout)
+
+	def status(self, frame_ages=None, connections=None):
+		"""
+			Returns the state of every camera as a dictionary.
+			frame_ages: optional dictionary of seconds since the last new frame of each camera, used to report stalled cameras as degraded
+			connections: optional dictionary of the connection_stats() of each camera, reconnecting cameras are reported as degraded
+		"""
+		frame_ages = frame_ages or {}
+		connections = connections or {}
+		now = time.time()
+		with self._lock:
+			statuses = list(self.statuses.values())
+
+		result = {}
+		for s in statuses:
+			state = s.state
+			age = frame_ages.get(s.name)
+			connection = connections.get(s.name, {})
+			if state == LIVE and (connection.get("reconnecting") or (age is not None and age > self.stall_after)):
+				state = DEGRADED
+			result[s.name] = {
+				"state": state,
+				"error": s.error,
+				"connect_seconds": s.connect_seconds,
+				"seconds_in_state": now - s.changed_at,
+				"frame_age": age,
+				"connect_attempts": s.attempts,
+				"retry_in": max(0.0, s.retry_at - now) if state == FAILED and s.retry_at is not None else None,
+			}
+			result[s.name].update(connection)
+		return result
+
+	def __connect(self, status, open_camera, backoff, attempt):
+		"""
+			Opens one camera, run on its own thread.
+			attempt: number of this attempt, a newer attempt makes this one late
+		"""
+		permit = _Permit(self._slots)
+		timer = threading.Timer(self.connect_timeout, self.__time_out, args=(status, open_camera, backoff, attempt, permit))
+		timer.daemon = True
+		with self._lock:
+			status.started_at = status.changed_at = time.time()
+		timer.start()
+		try:
+			camera = open_camera()
+			error = None
+		except Exception as e:
+			camera = None
+			error = "{}: {}".format(type(e).__name__, e)
+		finally:
+			timer.cancel()
+			permit.release()
+
+		with self._lock:
+			late = status.state != CONNECTING or status.attempts != attempt
+			if not late:
+				if camera is None:
+					status.set_state(FAILED, error)
+					self.__schedule_retry(status, open_camera, backoff)
+				else:
+					status.set_state(LIVE)
+					status.connect_seconds = status.changed_at - status.started_at
+			self._lock.notify_all()
+
+		if late:
+			# Timed out or removed while connecting, the stream is not used
+			if camera is not None:
+				camera.stop_video_stream()
+			return
+		if camera is None:
+			print("[ERROR] could not open camera {}: {}, retrying in {:.1f}s".format(status.name, error, status.retry_at - time.time()))
+			return
+
+		self.on_ready(status.name, camera)
+
+	def __time_out(self, status, open_camera, backoff, attempt, permit):
+		"""
+			Marks a camera that is still connecting after connect_timeout as failed. The hanging attempt gives up its slot
+			so it does not hold back the other cameras.
+		"""
+		with self._lock:
+			if status.state != CONNECTING or status.attempts != attempt:
+				return
+			status.set_state(FAILED, "no frame within {} seconds".format(self.connect_timeout))
+			self.__schedule_retry(status, open_camera, backoff)
+			self._lock.notify_all()
+		permit.release()
+		print("[ERROR] could not open camera {}: {}, retrying in {:.1f}s".format(status.name, status.error, status.retry_at - time.time()))
+
+	def __schedule_retry(self, status, open_camera, backoff):
+		"""
+			Retries a failed camera after the next backoff wait, called with the lock held.
+		"""
+		wait = backoff.next_wait()
+		status.retry_at = time.time() + wait
+		timer = threading.Timer(wait, self.__retry, args=(status, open_camera, backoff))
+		timer.daemon = True
+		timer.start()
+
+	def __retry(self, status, open_camera, backoff):
+		"""
+			Starts a new attempt on a camera that is still failed and was neither removed nor added again.
+		"""
+		with self._lock:
+			if self.statuses.get(status.name) is not status or status.state != FAILED:
+				return
+			status.attempts += 1
+			status.retry_at = None
+			status.set_state(CONNECTING)
+			attempt = status.attempts
+			self._lock.notify_all()
+
+		threading.Thread(target=self.__connect, args=(status, open_camera, backoff, attempt), daemon=True).start()
+
+class _Permit:
+	"""
+		Slot of the connection semaphore held by one attempt, released once when the attempt ends or times out.
+	"""
+
+	def __init__(self, slots):
+		self.slots = slots
+		self._released = False
+		self._lock = threading.Lock()
+		slots.acquire()
+
+	def release(self):
+		with self._lock:
+			if self._released:
+				return
+			self._released = True
+		self.slots.release()
@@ -0,0 +1,167 @@
+# Python-specific imports
+import collections
+import threading
+import time
+import cv2
+import numpy as np
+
+# A decoded frame with its sequence number and capture time, stale when it is the last good frame of a stream that stopped
+CapturedFrame = collections.namedtuple('CapturedFrame', ['seq', 'timestamp', 'frame', 'stale'], defaults=(False,))
+
+# Capture policies of VideoCaptureThread
+REALTIME = "realtime"
+BATCH = "batch"
+
+class FrameRing:
+	"""
+		Small ring of preallocated frames filled by one capture thread. Frames are numbered with increasing sequence numbers.
+		size: number of frames kept
+		sample_frame: frame used to allocate the ring, all frames are expected to have its shape
+		first_seq: sequence number the ring starts after, so the numbers keep increasing when a stream is reopened
+	"""
+
+	def __init__(self, size, sample_frame, first_seq=0):
+		"""
+			Allocates the frames of the ring.
+		"""
+		self.size = max(2, size)
+		self.frames = [np.empty_like(sample_frame) for _ in range(self.size)]
+		self.timestamps = [0.0] * self.size
+		self.seq = first_seq
+		self.consumed = first_seq
+		self.first_seq = first_seq
+		self.condition = threading.Condition()
+
+	def next_slot(self):
+		"""
+			Returns the preallocated frame the next capture should be decoded into.
+		"""
+		return self.frames[(self.seq + 1) % self.size]
+
+	def commit(self, frame, timestamp):
+		"""
+			Publishes the frame decoded into next_slot(). frame replaces the slot if the decoder had to allocate a new one.
+		"""
+		with self.condition:
+			index = (self.seq + 1) % self.size
+			self.frames[index] = frame
+			self.timestamps[index] = timestamp
+			self.seq += 1
+			self.condition.notify_all()
+
+	def wait_for_space(self, timeout=None):
+		"""
+			Blocks while every slot holds a frame that has not been consumed yet, used when no frame may be dropped.
+		"""
+		with self.condition:
+			return self.condition.wait_for(lambda: self.seq - self.consumed < self.size, timeout)
+
+	def latest(self):
+		"""
+			Returns a copy of the newest frame as a CapturedFrame, or None if nothing was captured yet. Never waits for decode.
+		"""
+		with self.condition:
+			if self.seq == self.first_seq:
+				return None
+			index = self.seq % self.size
+			return CapturedFrame(self.seq, self.timestamps[index], self.frames[index].copy())
+
+	def next(self, after_seq, timeout=None):
+		"""
+			Returns a copy of the oldest frame still in the ring that is newer than after_seq, waiting for one if needed.
+			returns None on timeout
+		"""
+		with self.condition:
+			if not self.condition.wait_for(lambda: self.seq > after_seq, timeout):
+				return None
+			seq = max(after_seq + 1, self.seq - self.size + 1)
+			index = seq % self.size
+			self.consumed = seq
+			self.condition.notify_all()
+			return CapturedFrame(seq, self.timestamps[index], self.frames[index].copy())
+
+class VideoCaptureThread(threading.Thread):
+	"""
+		Decodes a video file into a FrameRing on its own thread so consumers never block on decode.
+		path: path of the video file
+		capture: opened cv2.VideoCapture of the file
+		sample_frame: first frame read from the capture
+		policy: realtime paces decode to the file's fps and skips frames when decode falls behind, to simulate a live camera.
+			batch decodes as fast as the consumer reads and never drops a frame.
+		ring_size: number of frames kept in the ring
+		first_seq: sequence number of the last frame read before, when the file is reopened
+	"""
+
+	def __init__(self, path, capture, sample_frame, policy=REALTIME, ring_size=4, first_seq=0):
+		"""
+			Basic setup of the thread, the first frame is put in the ring right away.
+		"""
+		super(VideoCaptureThread, self).__init__(daemon=True)
+		if policy not in (REALTIME, BATCH):
+			raise ValueError("Unknown capture policy {}, choose between {}, {}".format(policy, REALTIME, BATCH))
+
+		self.path = path
+		self.capture = capture
+		self.policy = policy
+		self.ring = FrameRing(ring_size, sample_frame, first_seq)
+		self.ring.commit(sample_frame.copy(), time.time())
+		self.dropped = 0
+		self._stop_event = threading.Event()
+
+		fps = capture.get(cv2.CAP_PROP_FPS)
+		self.interval = 1.0 / fps if fps and fps > 0 and fps == fps else 1.0 / 30
+
+	def stop(self, timeout=2.0):
+		"""
+			Stops decoding and releases the capture.
+		"""
+		self._stop_event.set()
+		with self.ring.condition:
+			self.ring.condition.notify_all()
+		if self is not threading.current_thread() and self.is_alive():
+			self.join(timeout)
+		self.capture.release()
+
+	def rewind(self):
+		"""
+			Starts the file over once it reaches the end, reopening it only if seeking back is not supported.
+		"""
+		self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+		grabbed, frame = self.capture.read(self.ring.next_slot())
+		if not grabbed:
+			self.capture.release()
+			self.capture = cv2.VideoCapture(self.path)
+			grabbed, frame = self.capture.read(self.ring.next_slot())
+		return grabbed, frame
+
+	def run(self):
+		"""
+			Decode loop.
+		"""
+		start = time.time()
+		decoded = 1
+		while not self._stop_event.is_set():
+			if self.policy == REALTIME:
+				# Wait until the next frame is due, then skip frames without decoding them if we fell behind
+				due = start + decoded * self.interval
+				if self._stop_event.wait(max(0.0, due - time.time())):
+					break
+				while time.time() - due > self.interval:
+					if not self.capture.grab():
+						break
+					self.dropped += 1
+					decoded += 1
+					due += self.interval
+			elif not self.ring.wait_for_space(timeout=0.5):
+				continue
+
+			grabbed, frame = self.capture.read(self.ring.next_slot())
+			if not grabbed:
+				grabbed, frame = self.rewind()
+				if not grabbed:
+					print("[ERROR] could not read video {}".format(self.path))
+					break
+				start, decoded = time.time(), 0
+
+			self.ring.commit(frame, time.time())
+			decoded += 1
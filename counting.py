@@ -0,0 +1,64 @@
+# Python-specific imports
+import threading
+
+class LaneCounter:
+	"""
+		Counting state of one lane of a camera. A number of vehicles in the lane is confirmed once min_frames consecutive detections
+		agree on it, every confirmed increase is a vehicle entering and every confirmed decrease a vehicle leaving.
+		Only the length of the current run of equal counts is kept, so an update is O(1) and allocates nothing.
+		min_frames: consecutive detections with the same number of vehicles needed to confirm it
+		confirmed: number of vehicles confirmed in the lane
+		car_count: number of vehicles that have left the lane
+	"""
+
+	def __init__(self, min_frames=5):
+		"""
+			Basic setup of an empty lane.
+		"""
+		self.min_frames = min_frames
+		self.confirmed = 0
+		self.car_count = 0
+		self._run_value = None
+		self._run_length = 0
+		self._lock = threading.Lock()
+
+	def update(self, num_cars):
+		"""
+			Adds the number of vehicles detected in a frame.
+			returns a list of ("enter" or "exit", vehicle id) caused by this frame, vehicles get their id in the order they entered
+		"""
+		with self._lock:
+			if num_cars == self._run_value:
+				self._run_length += 1
+			else:
+				self._run_value = num_cars
+				self._run_length = 1
+
+			if self._run_length < self.min_frames or num_cars == self.confirmed:
+				return []
+
+			previous = self.confirmed
+			self.confirmed = num_cars
+			if num_cars > previous:
+				return [("enter", self.car_count + i) for i in range(previous, num_cars)]
+
+			first_id = self.car_count
+			self.car_count += previous - num_cars
+			return [("exit", first_id + i) for i in range(previous - num_cars)]
+
+	def record_enter(self):
+		"""
+			Counts a vehicle entering the lane that was followed by other means, like a tracker.
+		"""
+		with self._lock:
+			self.confirmed += 1
+
+	def record_exit(self):
+		"""
+			Counts a vehicle leaving the lane that was followed by other means, like a tracker.
+			returns the id of the vehicle
+		"""
+		with self._lock:
+			self.confirmed = max(0, self.confirmed - 1)
+			self.car_count += 1
+			return self.car_count - 1
@@ -21,9 +21,6 @@
 import argparse
 import time
 import numpy as np
-from PIL import Image
-from PIL import ImageDraw
-import tflite_runtime.interpreter as tflite
 import platform
 
 # Package-specific imports
@@ -59,6 +56,9 @@ def load_labels(path, encoding='utf-8'):
 
 def make_interpreter(model_file):
 	"""Generate interpreter object, used for tpu models"""
+	# Only the tpu models need tflite_runtime, it is not installed on cpu-only deployments
+	import tflite_runtime.interpreter as tflite
+
 	model_file, *device = model_file.split('@')
 	return tflite.Interpreter(
 			model_path=model_file,
@@ -75,20 +75,20 @@ def draw_objects(draw, objs, labels):
 		draw.rectangle([(bbox.xmin, bbox.ymin), (bbox.xmax, bbox.ymax)], outline='red')
 		draw.text((bbox.xmin + 10, bbox.ymin + 10),'%s\n%.2f' % (labels.get(obj.id, obj.id), obj.score), fill='red')
 
-def tpu_mobilenet_detection(interpreter, labels, image, pickedClass, threshold=0.25, labeledOutputImage=True):
+def tpu_mobilenet_detection(session, labels, image, pickedClass, threshold=0.25, labeledOutputImage=True):
 	"""
 		Detection for mobilenet model, 
+		session: TfliteSession holding the mobilenet interpreter, the image is resized straight into its input tensor
 		returns filtered outputs: only outputs with the labels that we care about 
 	"""
 	#interpreter = make_interpreter(model)
 	#interpreter.allocate_tensors()
 
-	image = Image.fromarray(image)
-	scale = detect.set_input(interpreter, image.size, lambda size: image.resize(size, Image.ANTIALIAS))
+	scale = session.set_input(image)
 	start = time.perf_counter()
-	interpreter.invoke()
+	session.invoke()
 	inference_time = time.perf_counter() - start
-	objs = detect.get_output(interpreter, threshold, scale)
+	objs = detect.get_output(session.interpreter, threshold, (scale, scale))
 	
 	final_objs = []
 
@@ -98,12 +98,13 @@ def tpu_mobilenet_detection(interpreter, labels, image, pickedClass, threshold=0
 		if label_name in pickedClass:
 				final_objs.append(obj)
 
-	image = None
-
 	if labeledOutputImage:
-		image = image.convert('RGB')
+		from PIL import Image, ImageDraw
+		image = Image.fromarray(image).convert('RGB')
 		draw_objects(ImageDraw.Draw(image), objs, labels)
 		image = np.array(image)
+	else:
+		image = None
 
 	return final_objs, image
 
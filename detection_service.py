@@ -0,0 +1,343 @@
+# Python-specific imports
+import collections
+import threading
+import time
+import numpy as np
+
+# Package-specific imports
+from scheduler import DetectionScheduler
+from stream_hub import FrameHub
+from motion_gate import MotionGate
+from tracker import Tracker
+from metrics import METRICS
+from process_pool import InferenceProcessPool
+from YoloVideo import lane_counts
+from capture import BATCH
+
+# Result of the most recent detection run on a camera, lane_counts maps each lane of the ROI to its number of vehicles
+DetectionResult = collections.namedtuple('DetectionResult', ['num_cars', 'debug_frame', 'timestamp', 'seq', 'lane_counts'])
+
+# Detection intervals a track survives without a matching detection, unless the max age is set explicitly
+TRACK_AGE_MARGIN = 3.0
+
+# Debug frame shown until the first detection on a camera completes
+DEBUG_PLACEHOLDER = np.ones([100,100,3],dtype=np.uint8) * 155
+
+class CameraWorker(threading.Thread):
+	"""
+		Background capture loop for a single camera. Runs whether or not anyone is watching the stream and hands
+		frames to the detection scheduler at the target rate. A frame whose sequence number has not advanced is
+		neither published nor detected again. A video played with the batch policy submits every frame instead, the next
+		one as soon as the scheduler took the previous one, so the file plays as fast as detection consumes it.
+		name: key of the camera in the camera dictionary
+		camera: Camera or Video object to read frames from
+		scheduler: DetectionScheduler shared by every camera
+		target_fps: maximum number of detections per second for this camera
+		capture_fps: rate at which frames are pulled from the camera
+		stream_hub: FrameHub broadcasting the camera frames to the frontend
+		debug_hub: FrameHub broadcasting the detection debug frames to the frontend
+		motion_gate: optional MotionGate, frames where the ROI did not move are not submitted and the last result is kept
+		on_detection: optional callback(name, num_cars, lane_counts) run with the last result for the frames held back by the motion gate
+		detector_ready: threading.Event set once the detector is loaded, frames are captured and shown but not submitted until then
+		tracker: optional Tracker, moved along on every frame that is not detected
+		on_track_event: callback(name, event) run for the TrackEvents of the tracker
+	"""
+
+	def __init__(self, name, camera, scheduler, target_fps=5.0, capture_fps=30.0, motion_gate=None, tracker=None, on_track_event=None,
+				on_detection=None, detector_ready=None):
+		"""
+			Basic setup of the worker, the loop is started with start().
+		"""
+		super(CameraWorker, self).__init__(daemon=True)
+		self.camera_name = name
+		self.camera = camera
+		self.scheduler = scheduler
+		self.detection_interval = 1.0 / target_fps if target_fps > 0 else 0.0
+		self.capture_interval = 1.0 / capture_fps if capture_fps > 0 else 0.0
+		self.latest_frame = None
+		self.latest_seq = 0
+		self.latest_frame_at = None
+		self.latest_result = None
+		self.stream_hub = FrameHub(name, rate="display")
+		self.debug_hub = FrameHub(name, stage="debug_encode")
+		self.debug_hub.publish(DEBUG_PLACEHOLDER)
+		self.motion_gate = motion_gate
+		self.tracker = tracker
+		self.on_track_event = on_track_event
+		self.on_detection = on_detection
+		self.detector_ready = detector_ready
+		self.batch = getattr(camera, "policy", None) == BATCH
+		self._next_detection = 0.0
+		self._stop_event = threading.Event()
+
+	def stop(self):
+		"""
+			Asks the loop to exit after the current frame.
+		"""
+		self._stop_event.set()
+
+	def run(self):
+		"""
+			Pull frames from the camera, keep the latest one for display and submit frames for detection at the target rate.
+		"""
+		try:
+			self.latest_frame_at = time.time()
+			frames = iter(self.camera)
+			while not self._stop_event.is_set():
+				start = time.perf_counter()
+				frame = next(frames)
+				METRICS.observe("capture_wait", self.camera_name, time.perf_counter() - start)
+				if self._stop_event.is_set():
+					break
+
+				captured = frames.last
+				submitted = False
+				if captured.seq != self.latest_seq:
+					METRICS.tick("capture", self.camera_name, captured.timestamp)
+					self.latest_frame = frame
+					self.latest_seq = captured.seq
+					self.latest_frame_at = time.time()
+					self.stream_hub.publish(frame)
+
+					now = time.time()
+					detecting = self.detector_ready is None or self.detector_ready.is_set()
+					if self.camera.ROI and detecting and (self.batch or now >= self._next_detection):
+						self._next_detection = now + self.detection_interval
+						if self.motion_gate is None or self.motion_gate.should_detect(frame, self.camera.get_prepared_roi(), now):
+							self.scheduler.submit(self.camera_name, captured)
+							submitted = True
+						elif self.on_detection is not None and self.latest_result is not None:
+							# Nothing moved, the last result still holds and keeps confirming the lane counts
+							result = self.latest_result
+							self.on_detection(self.camera_name, result.num_cars, result.lane_counts)
+
+					# Frames without detection only move the tracks along
+					if self.tracker is not None and not submitted:
+						for event in self.tracker.predict(captured.timestamp):
+							self.on_track_event(self.camera_name, event)
+
+				if submitted and self.batch:
+					# Every frame gets detected, the next one is pulled once this one left the scheduler slot
+					while not self.scheduler.wait_taken(self.camera_name, 0.5) and not self._stop_event.is_set():
+						pass
+				elif not (self.batch and self.camera.ROI):
+					self._stop_event.wait(self.capture_interval)
+		except Exception as e:
+			print("[ERROR] camera {} stopped: {}".format(self.camera_name, e))
+
+class DetectionService:
+	"""
+		Keeps one CameraWorker running per camera. HTTP routes only read the latest frames and results from here.
+	"""
+
+	def __init__(self, detector, target_fps=5.0, on_detection=None, policy="round_robin", min_fps=0.0, max_staleness=None, batch_size=1,
+				motion_gate=False, heartbeat=5.0, tracking=False, on_track_event=None, workers=1, track_max_age=None):
+		"""
+			detector: shared detection model used by every camera, or an InferenceProcessPool running it in several processes.
+				Can be None while it loads, cameras are captured and shown right away and detected once it is set
+			target_fps: maximum number of detections per second for each camera
+			on_detection: optional callback(name, num_cars, lane_counts) run after each detection, lane_counts maps each lane to its number of vehicles.
+				Also run with the last result when the motion gate skips a detection
+			policy: scheduling policy used to share the detector, round_robin or weighted
+			min_fps: default minimum detections per second for each camera
+			max_staleness: default age in seconds after which a waiting frame is dropped
+			batch_size: maximum number of cameras run through the detector in one forward pass
+			motion_gate: whether detection is skipped on cameras whose ROI did not move since their last detection
+			heartbeat: maximum number of seconds between two detections on a gated camera
+			tracking: whether vehicles are tracked between detections on every camera
+			on_track_event: optional callback(name, event) run for every TrackEvent when tracking
+			workers: number of scheduler threads, more than one only helps with an InferenceProcessPool
+			track_max_age: seconds a track is kept without a matching detection, by default TRACK_AGE_MARGIN times the longest
+				interval between two detections (the detection interval, or the heartbeat with the motion gate) and at least one second
+		"""
+		self.detector_ready = threading.Event()
+		self.detector = detector
+		self.detector_lock = threading.Lock()
+		self.target_fps = target_fps
+		self.on_detection = on_detection
+		self.min_fps = min_fps
+		self.max_staleness = max_staleness
+		self.motion_gate = motion_gate
+		self.heartbeat = heartbeat
+		self.tracking = tracking
+		self.on_track_event = on_track_event
+		self.track_max_age = track_max_age
+		self.workers = {}
+		self.scheduler = DetectionScheduler(self.__process, policy=policy, workers=workers, batch_size=batch_size)
+		self.scheduler.start()
+
+	@property
+	def detector(self):
+		return self._detector
+
+	@detector.setter
+	def detector(self, detector):
+		"""
+			Sets the shared detector, the cameras start submitting frames once it is not None.
+		"""
+		self._detector = detector
+		if detector is not None:
+			self.detector_ready.set()
+
+	def start_camera(self, name, camera, weight=1.0, min_fps=None, max_staleness=None):
+		"""
+			Starts the background loop for a camera. Does nothing if the camera is already running.
+			weight, min_fps and max_staleness override the service defaults for this camera.
+		"""
+		if name in self.workers:
+			return self.workers[name]
+
+		self.scheduler.add_camera(name, weight=weight,
+			min_fps=self.min_fps if min_fps is None else min_fps,
+			max_staleness=self.max_staleness if max_staleness is None else max_staleness)
+
+		gate = MotionGate(heartbeat=self.heartbeat) if self.motion_gate else None
+		tracker = Tracker(max_age=self.__track_max_age()) if self.tracking else None
+		worker = CameraWorker(name, camera, self.scheduler, target_fps=self.target_fps, motion_gate=gate,
+			tracker=tracker, on_track_event=self.__track_event, on_detection=self.on_detection, detector_ready=self.detector_ready)
+		self.workers[name] = worker
+		worker.start()
+		return worker
+
+	def stop_camera(self, name, timeout=2.0):
+		"""
+			Stops the background loop for a camera and waits for it to exit.
+		"""
+		worker = self.workers.pop(name, None)
+		if worker is None:
+			return
+
+		self.scheduler.remove_camera(name)
+		worker.stop()
+		if worker is not threading.current_thread():
+			worker.join(timeout)
+		METRICS.forget(name)
+
+	def stop_all(self):
+		"""
+			Stops every running camera loop.
+		"""
+		for name in list(self.workers):
+			self.stop_camera(name)
+		self.scheduler.stop()
+
+	def stats(self):
+		"""
+			Returns per-camera detection statistics from the scheduler, with the frames let through and held back by the motion gates,
+			the frames dropped by video capture and the reconnections of the camera.
+		"""
+		stats = self.scheduler.stats()
+		for name, worker in list(self.workers.items()):
+			if name not in stats:
+				continue
+			if worker.motion_gate is not None:
+				stats[name]["gate_passed"] = worker.motion_gate.passed
+				stats[name]["gate_skipped"] = worker.motion_gate.skipped
+			capture_thread = getattr(worker.camera, "capture_thread", None)
+			if capture_thread is not None:
+				stats[name]["capture_dropped"] = capture_thread.dropped
+			connection_stats = getattr(worker.camera, "connection_stats", None)
+			if connection_stats is not None:
+				stats[name].update(connection_stats())
+		return stats
+
+	def frame_ages(self):
+		"""
+			Returns the seconds since each running camera last delivered a new frame.
+		"""
+		now = time.time()
+		return {name: now - worker.latest_frame_at for name, worker in list(self.workers.items()) if worker.latest_frame_at is not None}
+
+	def __process(self, batch):
+		"""
+			Run by the scheduler: runs the shared detector on a batch of (name, CapturedFrame) pairs and stores the results on the camera workers.
+			Frames already detected on their camera are skipped.
+		"""
+		batch = [(name, captured, self.workers[name]) for name, captured in batch
+			if name in self.workers and not self.__already_detected(self.workers[name], captured)]
+		if not batch:
+			return
+
+		if isinstance(self.detector, InferenceProcessPool):
+			# Every process has its own model, batches of different scheduler threads run side by side
+			results, vehicles, stage_times = zip(*self.detector.detect_batch(
+				[captured.frame for _, captured, _ in batch], [worker.camera for _, _, worker in batch]))
+		else:
+			results, vehicles, stage_times = self.__detect(batch)
+
+		now = time.time()
+		for (name, captured, worker), (num_cars, debug_frame), detections, times in zip(batch, results, vehicles, stage_times):
+			METRICS.observe_all(name, times)
+			METRICS.tick("detection", name, now)
+			# With several scheduler threads a newer frame of the camera can finish first
+			if self.__already_detected(worker, captured):
+				continue
+			counts = lane_counts(detections)
+			worker.latest_result = DetectionResult(num_cars, debug_frame, now, captured.seq, counts)
+			worker.debug_hub.publish(debug_frame)
+
+			if worker.tracker is not None:
+				for event in worker.tracker.update(detections.boxes, detections.accepted, captured.timestamp,
+						detections.lanes, detections.lane_names):
+					self.__track_event(name, event)
+
+			if self.on_detection is not None:
+				self.on_detection(name, num_cars, counts)
+
+	def __detect(self, batch):
+		"""
+			Runs the in-process detector on a batch, one batch at a time.
+			returns the (carAmount, debug image), VehicleDetections and stage times of each frame
+		"""
+		with self.detector_lock:
+			if len(batch) == 1:
+				name, captured, worker = batch[0]
+				self.detector.set_frame_and_roi(captured.frame, worker.camera)
+				results = [self.detector.detect_intersections()]
+				vehicles = [self.detector.vehicle_detections]
+				stage_times = [self.detector.stage_times]
+			else:
+				results = self.detector.detect_intersections_batch(
+					[captured.frame for _, captured, _ in batch], [worker.camera for _, _, worker in batch])
+				vehicles = self.detector.batch_vehicle_detections
+				stage_times = self.detector.batch_stage_times
+		return results, vehicles, stage_times
+
+	def __track_max_age(self):
+		"""
+			Seconds a track is kept without a detection, long enough for the next detection to match it.
+		"""
+		if self.track_max_age is not None:
+			return self.track_max_age
+		interval = 1.0 / self.target_fps if self.target_fps > 0 else 0.0
+		if self.motion_gate:
+			interval = max(interval, self.heartbeat)
+		return max(1.0, TRACK_AGE_MARGIN * interval)
+
+	def __track_event(self, name, event):
+		"""
+			Forwards a TrackEvent of a camera to the on_track_event callback.
+		"""
+		if self.on_track_event is not None:
+			self.on_track_event(name, event)
+
+	@staticmethod
+	def __already_detected(worker, captured):
+		"""
+			Whether the worker already has a detection result for this frame or a newer one.
+		"""
+		return worker.latest_result is not None and worker.latest_result.seq >= captured.seq
+
+	def stream_hub(self, name):
+		"""
+			Returns the FrameHub broadcasting the frames of the camera, or None.
+		"""
+		worker = self.workers.get(name)
+		return worker.stream_hub if worker is not None else None
+
+	def debug_hub(self, name):
+		"""
+			Returns the FrameHub broadcasting the debug frames of the camera, or None.
+		"""
+		worker = self.workers.get(name)
+		return worker.debug_hub if worker is not None else None
@@ -0,0 +1,275 @@
+# Python-specific imports
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+# Package-specific imports
+from metrics import METRICS
+
+# Returned by an output's write() when it kept the batch for a later delivery instead of delivering it
+SPOOLED = "spooled"
+
+class EventSink:
+	"""
+		Delivers count messages off the detection threads. emit() only puts the message on a bounded in-memory queue,
+		a background writer takes them off in batches and hands every batch to each output. When the queue is full the
+		message is dropped and counted, detection never waits for event I/O. The time from emit() to the end of the
+		write is recorded per camera as the event_delivery stage of the metrics.
+		outputs: objects with a write(batch) method taking a list of messages and a close() method, write returns SPOOLED
+			when the batch could not be delivered yet and was kept for later
+		max_queue: maximum number of messages waiting for the writer
+		batch_size: maximum number of messages written at once
+		flush_interval: seconds the writer waits to fill a batch before writing what it has
+	"""
+
+	def __init__(self, outputs, max_queue=10000, batch_size=100, flush_interval=1.0):
+		"""
+			Starts the background writer.
+		"""
+		self.outputs = outputs
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = queue.Queue(maxsize=max_queue)
+		self.emitted = 0
+		self.dropped = 0
+		self.written = 0
+		self.spooled = 0
+		self.failed = 0
+		self._running = True
+		self._thread = threading.Thread(target=self.__run, daemon=True)
+		self._thread.start()
+
+	def emit(self, message):
+		"""
+			Queues a message for the outputs without blocking. returns False if it was dropped.
+		"""
+		try:
+			self.queue.put_nowait((time.time(), message))
+		except queue.Full:
+			self.dropped += 1
+			return False
+		self.emitted += 1
+		return True
+
+	def stats(self):
+		"""
+			Returns the queue depth and the message counters, written, spooled and failed are counted once per output.
+		"""
+		return {
+			"queue_depth": self.queue.qsize(),
+			"emitted": self.emitted,
+			"dropped": self.dropped,
+			"written": self.written,
+			"spooled": self.spooled,
+			"failed": self.failed,
+		}
+
+	def close(self, timeout=5.0):
+		"""
+			Writes the messages still queued and closes the outputs.
+		"""
+		self._running = False
+		self._thread.join(timeout)
+		for output in self.outputs:
+			output.close()
+
+	def __next_batch(self):
+		"""
+			Waits for a first message, then takes more until the batch is full or flush_interval has passed.
+		"""
+		try:
+			batch = [self.queue.get(timeout=self.flush_interval)]
+		except queue.Empty:
+			return []
+
+		deadline = time.time() + self.flush_interval
+		while len(batch) < self.batch_size:
+			remaining = deadline - time.time()
+			try:
+				batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+			except queue.Empty:
+				break
+		return batch
+
+	def __run(self):
+		"""
+			Writer loop, keeps going after close() until the queue is empty.
+		"""
+		while self._running or not self.queue.empty():
+			queued = self.__next_batch()
+			if not queued:
+				continue
+
+			batch = [message for _, message in queued]
+			for output in self.outputs:
+				try:
+					if output.write(batch) == SPOOLED:
+						self.spooled += len(batch)
+					else:
+						self.written += len(batch)
+				except Exception as e:
+					self.failed += len(batch)
+					print("[ERROR] event output {} failed: {}".format(type(output).__name__, e))
+
+			now = time.time()
+			for emitted_at, message in queued:
+				METRICS.observe("event_delivery", message.get("camera_id", ""), now - emitted_at)
+
+class StdoutOutput:
+	"""
+		Prints every message, what the app did before messages had outputs.
+	"""
+
+	def write(self, batch):
+		for message in batch:
+			print(message)
+
+	def close(self):
+		pass
+
+class JsonlOutput:
+	"""
+		Appends messages as JSON lines to a file that is rotated by size. The file is fsynced once per batch instead of once per message.
+		path: path of the current log file, rotated files get .1, .2, ... appended
+		max_bytes: size after which the file is rotated
+		backup_count: number of rotated files kept
+	"""
+
+	def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+		"""
+			Opens the log file, creating its directory if needed.
+		"""
+		self.path = path
+		self.max_bytes = max_bytes
+		self.backup_count = backup_count
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		self.file = open(path, "a")
+
+	def write(self, batch):
+		self.file.write("".join(json.dumps(message) + "\n" for message in batch))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+		if self.file.tell() >= self.max_bytes:
+			self.rotate()
+
+	def rotate(self):
+		"""
+			Moves path to path.1, path.1 to path.2 and so on, dropping the oldest file.
+		"""
+		self.file.close()
+		for i in range(self.backup_count - 1, 0, -1):
+			if os.path.exists("{}.{}".format(self.path, i)):
+				os.replace("{}.{}".format(self.path, i), "{}.{}".format(self.path, i + 1))
+		if self.backup_count > 0:
+			os.replace(self.path, self.path + ".1")
+		else:
+			os.remove(self.path)
+		self.file = open(self.path, "a")
+
+	def close(self):
+		self.file.close()
+
+class HttpOutput:
+	"""
+		POSTs every batch as a JSON array to an HTTP endpoint. Failed posts are retried with exponential backoff and jitter,
+		then spooled to disk. Spooled batches are sent first once the endpoint answers again.
+		url: endpoint receiving the batches
+		spool_path: JSON lines file holding the batches that could not be delivered
+		retries: number of attempts per batch
+		backoff: seconds before the first retry, doubled after every failure up to max_backoff
+		timeout: seconds to wait for the endpoint
+	"""
+
+	def __init__(self, url, spool_path="logs/events_spool.jsonl", retries=3, backoff=0.5, max_backoff=30.0, timeout=2.0):
+		"""
+			Basic setup of the output, nothing is sent until the first batch.
+		"""
+		self.url = url
+		self.spool_path = spool_path
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.timeout = timeout
+		self.sent = 0
+		self.spooled = 0
+		# While the endpoint is down, batches go straight to the spool until this time
+		self._retry_at = 0.0
+		self._delay = backoff
+
+	def post(self, batch):
+		"""
+			Sends one batch, raises on failure.
+		"""
+		data = json.dumps(batch).encode()
+		req = urllib.request.Request(self.url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+		with urllib.request.urlopen(req, timeout=self.timeout) as response:
+			response.read()
+
+	def write(self, batch):
+		"""
+			Posts a batch, returns SPOOLED when the endpoint is down and the batch went to the spool.
+		"""
+		if time.time() < self._retry_at:
+			self.spool(batch)
+			return SPOOLED
+
+		for attempt in range(self.retries):
+			try:
+				self.drain_spool()
+				self.post(batch)
+				self.sent += len(batch)
+				self._delay = self.backoff
+				return
+			except Exception:
+				if attempt + 1 < self.retries:
+					time.sleep(self._delay * random.uniform(0.5, 1.5))
+				self._delay = min(self._delay * 2, self.max_backoff)
+
+		# The endpoint is down, keep the batch and stop trying for a while
+		self._retry_at = time.time() + self._delay * random.uniform(0.5, 1.5)
+		self.spool(batch)
+		return SPOOLED
+
+	def spool(self, batch):
+		"""
+			Appends a batch that could not be delivered to the spool file.
+		"""
+		directory = os.path.dirname(self.spool_path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with open(self.spool_path, "a") as spool_file:
+			spool_file.write(json.dumps(batch) + "\n")
+			spool_file.flush()
+			os.fsync(spool_file.fileno())
+		self.spooled += len(batch)
+
+	def drain_spool(self):
+		"""
+			Sends the spooled batches in order, the spool is only removed once all of them were delivered.
+		"""
+		if not os.path.exists(self.spool_path):
+			return
+
+		with open(self.spool_path) as spool_file:
+			batches = [json.loads(line) for line in spool_file if line.strip()]
+
+		for i, batch in enumerate(batches):
+			try:
+				self.post(batch)
+			except Exception:
+				# Keep what was not delivered yet
+				with open(self.spool_path, "w") as spool_file:
+					spool_file.write("".join(json.dumps(b) + "\n" for b in batches[i:]))
+				raise
+			self.sent += len(batch)
+		os.remove(self.spool_path)
+
+	def close(self):
+		pass
@@ -1,6 +1,199 @@
 # Python-specific imports
+import numpy as np
 from shapely.geometry import Polygon
-import matplotlib.pyplot as plt
+
+# Name of the lane of a camera with a single ROI
+DEFAULT_LANE = "default"
+
+class PreparedROI:
+	"""
+		Region of Interest built once per ROI and frame resolution, used to evaluate many axis-aligned bounding boxes at once.
+		coordinates: list of [x,y] coordinates of the ROI in frame pixels
+		polygon: shapely Polygon of the ROI
+		area: area of the ROI
+		bounds: (xmin, ymin, xmax, ymax) of the ROI
+		thresh: 0.0-1.0 threshold used to vary acceptance whether a BBOX is within the ROI or not
+		name: name of the lane the ROI covers
+	"""
+
+	def __init__(self, coordinates, thresh=0.7, name=DEFAULT_LANE):
+		"""
+			Builds the polygon and the per-edge arrays used by evaluate().
+		"""
+		self.name = name
+		self.coordinates = [[float(x), float(y)] for x, y in coordinates]
+		self.polygon = Polygon([tuple(l) for l in self.coordinates])
+		self.area = self.polygon.area
+		self.bounds = self.polygon.bounds
+		self.thresh = thresh
+
+		# Start and end point of every edge of the ROI
+		ring = np.asarray(self.polygon.exterior.coords, dtype=np.float64)
+		self._xa, self._ya = ring[:-1, 0], ring[:-1, 1]
+		self._xb, self._yb = ring[1:, 0], ring[1:, 1]
+
+	def intersection_areas(self, boxes):
+		"""
+			Area of the intersection between the ROI and each box.
+			boxes: (N,4) array of [x, y, width, height] boxes
+			returns (N,) array of areas
+		"""
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		areas = np.zeros(len(boxes))
+
+		# Only boxes overlapping the bounds of the ROI can intersect it
+		xmin, ymin, xmax, ymax = self.bounds
+		candidates = (boxes[:, 0] < xmax) & (boxes[:, 0] + boxes[:, 2] > xmin) \
+					& (boxes[:, 1] < ymax) & (boxes[:, 1] + boxes[:, 3] > ymin)
+		if not candidates.any():
+			return areas
+
+		# Rows are boxes, columns are ROI edges. The y axis is shifted so every box spans [0, h].
+		x0 = boxes[candidates, 0:1]
+		x1 = x0 + boxes[candidates, 2:3]
+		y0 = boxes[candidates, 1:2]
+		h = boxes[candidates, 3:4]
+		xa, xb = self._xa[None, :], self._xb[None, :]
+		ya, yb = self._ya[None, :] - y0, self._yb[None, :] - y0
+
+		# Part of every edge that lies within the box columns, integrated in the direction of the edge
+		lo = np.maximum(np.minimum(xa, xb), x0)
+		hi = np.maximum(np.minimum(np.maximum(xa, xb), x1), lo)
+		forward = xa <= xb
+		u_start = np.where(forward, lo, hi)
+		u_end = np.where(forward, hi, lo)
+		dx = u_end - u_start
+
+		# Edge height at both ends of that part
+		slope = np.divide(yb - ya, xb - xa, out=np.zeros_like(dx), where=xb != xa)
+		y_start = ya + (u_start - xa) * slope
+		y_end = ya + (u_end - xa) * slope
+
+		# Green's theorem: the area is the integral along the boundary of the edge height clamped to [0, h],
+		# using G as the antiderivative of the clamp
+		def G(y):
+			return np.where(y <= 0, 0.0, np.where(y <= h, y * y / 2, h * h / 2 + h * (y - h)))
+
+		dy = y_end - y_start
+		flat = np.abs(dy) < 1e-9
+		integral = np.where(flat,
+							np.clip(y_start, 0, h) * dx,
+							(G(y_end) - G(y_start)) * np.divide(dx, dy, out=np.zeros_like(dx), where=~flat))
+
+		areas[candidates] = np.abs(integral.sum(axis=1))
+		return areas
+
+	def evaluate(self, boxes):
+		"""
+			Evaluates every box against the ROI in one pass, using the same acceptance rule as intersection_of_polygons.
+			boxes: (N,4) array of [x, y, width, height] boxes
+			returns (N,) arrays: fraction of each box inside the ROI, fraction of the ROI covered by each box, and accept flags
+		"""
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		intersect_areas = self.intersection_areas(boxes)
+		box_areas = boxes[:, 2] * boxes[:, 3]
+
+		percent_bbox = np.divide(intersect_areas, box_areas, out=np.zeros_like(intersect_areas), where=box_areas > 0)
+		percent_roi = intersect_areas / self.area if self.area > 0 else np.zeros_like(intersect_areas)
+
+		accepted = (intersect_areas > 0) & (np.isclose(intersect_areas, self.area) | np.isclose(intersect_areas, box_areas)
+						| (percent_bbox > self.thresh) | (percent_roi > self.thresh))
+
+		return percent_bbox, percent_roi, accepted
+
+	def accepts(self, box):
+		"""
+			Whether a single [x, y, width, height] box is within the ROI.
+		"""
+		return bool(self.evaluate([box])[2][0])
+
+	@property
+	def lanes(self):
+		"""
+			A single ROI is a set of one lane, see PreparedROISet.
+		"""
+		return [self]
+
+	@property
+	def lane_names(self):
+		return (self.name,)
+
+	def evaluate_lanes(self, boxes):
+		"""
+			returns (1,N) accept flags of the boxes, see PreparedROISet.evaluate_lanes
+		"""
+		return self.evaluate(boxes)[2][None, :]
+
+	def padded_bounds(self, padding, width, height):
+		"""
+			Integer bounding rectangle of the ROI grown by padding times its size on every side and clipped to the frame.
+			width, height: size of the frame
+			returns (x0, y0, x1, y1)
+		"""
+		return padded_bounds(self.bounds, padding, width, height)
+
+class PreparedROISet:
+	"""
+		Named ROIs (lanes) of one camera, evaluated together against the boxes of a single detection.
+		The bounds of every lane are checked against every box at once, only the lanes a box overlaps are evaluated exactly.
+		lanes: list of PreparedROI, each with its own name and threshold
+		lane_names: names of the lanes in order
+		coordinates: coordinates of the first lane, for code that only knows about a single ROI
+		bounds: (xmin, ymin, xmax, ymax) of all lanes together
+	"""
+
+	def __init__(self, lanes):
+		"""
+			lanes: list of PreparedROI, at least one
+		"""
+		self.lanes = list(lanes)
+		self.lane_names = tuple(lane.name for lane in self.lanes)
+		self.coordinates = self.lanes[0].coordinates
+		self._bounds = b = np.array([lane.bounds for lane in self.lanes], dtype=np.float64)
+		self.bounds = (float(b[:, 0].min()), float(b[:, 1].min()), float(b[:, 2].max()), float(b[:, 3].max()))
+
+	def evaluate_lanes(self, boxes):
+		"""
+			Evaluates every box against every lane.
+			boxes: (N,4) array of [x, y, width, height] boxes
+			returns (L,N) array of accept flags, row i belongs to lanes[i]
+		"""
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		accepted = np.zeros((len(self.lanes), len(boxes)), dtype=bool)
+		if not len(boxes):
+			return accepted
+
+		# Rows are lanes, columns are boxes
+		b = self._bounds
+		overlaps = (boxes[None, :, 0] < b[:, 2:3]) & (boxes[None, :, 0] + boxes[None, :, 2] > b[:, 0:1]) \
+					& (boxes[None, :, 1] < b[:, 3:4]) & (boxes[None, :, 1] + boxes[None, :, 3] > b[:, 1:2])
+
+		for i in np.flatnonzero(overlaps.any(axis=1)):
+			candidates = overlaps[i]
+			accepted[i, candidates] = self.lanes[i].evaluate(boxes[candidates])[2]
+		return accepted
+
+	def padded_bounds(self, padding, width, height):
+		"""
+			Integer bounding rectangle of all lanes grown by padding times its size on every side and clipped to the frame.
+			returns (x0, y0, x1, y1)
+		"""
+		return padded_bounds(self.bounds, padding, width, height)
+
+def padded_bounds(bounds, padding, width, height):
+	"""
+		Integer rectangle of (xmin, ymin, xmax, ymax) bounds grown by padding times its size on every side and clipped to the frame.
+		width, height: size of the frame
+		returns (x0, y0, x1, y1)
+	"""
+	xmin, ymin, xmax, ymax = bounds
+	pad_x = (xmax - xmin) * padding
+	pad_y = (ymax - ymin) * padding
+	x0 = min(max(int(np.floor(xmin - pad_x)), 0), width - 1)
+	y0 = min(max(int(np.floor(ymin - pad_y)), 0), height - 1)
+	x1 = max(min(int(np.ceil(xmax + pad_x)), width), x0 + 1)
+	y1 = max(min(int(np.ceil(ymax + pad_y)), height), y0 + 1)
+	return x0, y0, x1, y1
 
 def intersection_of_polygons(ROI, BBOX, thresh=0.7, debug=False, showPlot=False, figure="1"):
 	"""
@@ -30,12 +223,13 @@ def intersection_of_polygons(ROI, BBOX, thresh=0.7, debug=False, showPlot=False,
 	isIntersectPercentRelativeROI = INTERSECT.area/ROI.area # intersection percentage relative to ROI
 	isIntersectPercentRelativeBBOX = INTERSECT.area/BBOX.area # intersection percentage relative to BBOX
 
-	isIntersectCoord = [list(l) for l in list(INTERSECT.exterior.coords)] # intersection coordinates
 	isVehicleCounted = isIntersectArea == ROI.area or isIntersectArea == BBOX.area \
 						or isIntersectPercentRelativeBBOX > thresh \
 						or isIntersectPercentRelativeROI > thresh # determine whether to count BBOX in ROI or not
 
 	if debug:
+		# the intersection can also be a point, line or several polygons when the shapes only touch or the ROI is concave
+		isIntersectCoord = [list(l) for l in INTERSECT.exterior.coords] if INTERSECT.geom_type == "Polygon" else INTERSECT.wkt # intersection coordinates
 		print("BBOX intersects ROI: {}".format(isIntersect))
 		print("Area of intersection: {}".format(isIntersectArea))
 		print("{:2f}% of BBOX intersects with ROI".format(isIntersectPercentRelativeBBOX * 100))
@@ -45,6 +239,8 @@ def intersection_of_polygons(ROI, BBOX, thresh=0.7, debug=False, showPlot=False,
 		print()
 
 		if showPlot: # plot the graphs
+			import matplotlib.pyplot as plt
+
 			plt.plot(*ROI.exterior.xy, label="ROI", linewidth=4, color="magenta")
 			plt.plot(*BBOX.exterior.xy, label="BBOX", linewidth=4, color="orange")
 			if isIntersect:
@@ -0,0 +1,202 @@
+# Python-specific imports
+import bisect
+import collections
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds of ticks used to compute the achieved frame rates
+FPS_WINDOW = 5.0
+
+class Histogram:
+	"""
+		Latency histogram with fixed buckets, an observation is a bisect and two additions.
+		counts: number of observations per bucket, the last one counts observations above every bound
+	"""
+
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def quantile(self, q):
+		"""
+			Estimates the q quantile by interpolating inside the bucket holding it.
+		"""
+		if self.count == 0:
+			return 0.0
+
+		rank = q * self.count
+		seen = 0
+		for i, n in enumerate(self.counts):
+			if seen + n >= rank and n > 0:
+				lower = self.buckets[i - 1] if i > 0 else 0.0
+				upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+				return lower + (upper - lower) * (rank - seen) / n
+			seen += n
+		return self.buckets[-1]
+
+class FpsMeter:
+	"""
+		Achieved rate of an event over the last FPS_WINDOW seconds.
+	"""
+
+	def __init__(self, window=FPS_WINDOW):
+		self.window = window
+		self.ticks = collections.deque()
+
+	def tick(self, now):
+		self.ticks.append(now)
+		while self.ticks[0] < now - self.window:
+			self.ticks.popleft()
+
+	def fps(self, now):
+		while self.ticks and self.ticks[0] < now - self.window:
+			self.ticks.popleft()
+		if len(self.ticks) < 2:
+			return 0.0
+		return (len(self.ticks) - 1) / max(now - self.ticks[0], 1e-6)
+
+class Metrics:
+	"""
+		Per-camera stage latencies and frame rates of the pipeline, rendered in the Prometheus text format or as JSON.
+		Stages: capture_wait, preprocess, forward, decode, nms, roi, debug, encode, debug_encode, event_delivery.
+		Rates: capture, detection, display.
+		Gauges such as dropped frames and queue depths are read from the collectors when the metrics are rendered.
+	"""
+
+	def __init__(self):
+		self.histograms = {}
+		self.meters = {}
+		self.collectors = []
+		self._lock = threading.Lock()
+
+	def observe(self, stage, camera, seconds):
+		"""
+			Records the duration of one run of a stage on a camera.
+		"""
+		key = (stage, str(camera))
+		with self._lock:
+			histogram = self.histograms.get(key)
+			if histogram is None:
+				histogram = self.histograms[key] = Histogram()
+			histogram.observe(seconds)
+
+	def observe_all(self, camera, stage_times):
+		"""
+			Records a dictionary of stage durations of a camera.
+		"""
+		for stage, seconds in stage_times.items():
+			self.observe(stage, camera, seconds)
+
+	def tick(self, kind, camera, now=None):
+		"""
+			Counts one frame of a camera towards the achieved capture, detection or display rate.
+		"""
+		key = (kind, str(camera))
+		now = time.time() if now is None else now
+		with self._lock:
+			meter = self.meters.get(key)
+			if meter is None:
+				meter = self.meters[key] = FpsMeter()
+			meter.tick(now)
+
+	def add_collector(self, collector):
+		"""
+			Registers a callable returning (name, labels dictionary, value) gauges, read when the metrics are rendered.
+		"""
+		self.collectors.append(collector)
+
+	def forget(self, camera):
+		"""
+			Drops everything recorded for a removed camera.
+		"""
+		camera = str(camera)
+		with self._lock:
+			self.histograms = {key: h for key, h in self.histograms.items() if key[1] != camera}
+			self.meters = {key: m for key, m in self.meters.items() if key[1] != camera}
+
+	def gauges(self):
+		"""
+			Returns the (name, labels, value) gauges of every collector.
+		"""
+		gauges = []
+		for collector in self.collectors:
+			try:
+				gauges.extend(collector())
+			except Exception as e:
+				print("[ERROR] metrics collector failed: {}".format(e))
+		return gauges
+
+	def to_json(self):
+		"""
+			Returns the metrics as a dictionary: stage latency summaries and frame rates per camera, and the gauges.
+		"""
+		now = time.time()
+		stages = collections.defaultdict(dict)
+		fps = collections.defaultdict(dict)
+		with self._lock:
+			for (stage, camera), h in self.histograms.items():
+				stages[camera][stage] = {
+					"count": h.count,
+					"mean": h.sum / h.count if h.count else 0.0,
+					"p50": h.quantile(0.5),
+					"p90": h.quantile(0.9),
+					"p99": h.quantile(0.99),
+				}
+			for (kind, camera), meter in self.meters.items():
+				fps[camera][kind] = meter.fps(now)
+
+		return {
+			"stages": stages,
+			"fps": fps,
+			"gauges": [{"name": name, "labels": labels, "value": value} for name, labels, value in self.gauges()],
+		}
+
+	def to_prometheus(self):
+		"""
+			Returns the metrics in the Prometheus text exposition format.
+		"""
+		now = time.time()
+		lines = ["# TYPE pipeline_stage_seconds histogram"]
+		with self._lock:
+			for (stage, camera), h in sorted(self.histograms.items()):
+				labels = 'camera="{}",stage="{}"'.format(_escape(camera), stage)
+				cumulative = 0
+				for bound, n in zip(h.buckets, h.counts):
+					cumulative += n
+					lines.append('pipeline_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+				lines.append('pipeline_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, h.count))
+				lines.append('pipeline_stage_seconds_sum{{{}}} {}'.format(labels, h.sum))
+				lines.append('pipeline_stage_seconds_count{{{}}} {}'.format(labels, h.count))
+
+			lines.append("# TYPE pipeline_fps gauge")
+			for (kind, camera), meter in sorted(self.meters.items()):
+				lines.append('pipeline_fps{{camera="{}",kind="{}"}} {}'.format(_escape(camera), kind, meter.fps(now)))
+
+		typed = set()
+		for name, labels, value in self.gauges():
+			if name not in typed:
+				lines.append("# TYPE pipeline_{} gauge".format(name))
+				typed.add(name)
+			rendered = ",".join('{}="{}"'.format(key, _escape(str(v))) for key, v in sorted(labels.items()))
+			lines.append("pipeline_{}{{{}}} {}".format(name, rendered, float(value)))
+
+		return "\n".join(lines) + "\n"
+
+def _escape(value):
+	"""
+		Escapes a Prometheus label value.
+	"""
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Metrics of the running app, recorded into by every part of the pipeline
+METRICS = Metrics()
@@ -0,0 +1,176 @@
+# Python-specific imports
+import time
+import numpy as np
+import cv2
+
+# Package-specific imports
+import detect
+from detect_image import load_labels
+from tpu_utils_tiny_yolo import get_anchors, get_classes
+
+class DnnSession:
+	"""
+		OpenCV DNN model with everything needed per frame resolved once at startup.
+		net: network returned by cv2.dnn.readNetFromDarknet
+		labels: dictionary mapping class ids to label names
+		layer_names: names of the output layers passed to net.forward
+		input_size: (width, height) the frames are resized to
+		blobs: preallocated input blobs, one per batch size, the frames are written into them
+	"""
+
+	def __init__(self, net, labels_path="models/coco_labels.txt", input_size=(416, 416)):
+		"""
+			Resolves labels and output layer names of the network.
+		"""
+		self.net = net
+		self.labels = load_labels(labels_path) if labels_path else {}
+		self.input_size = input_size
+		width, height = input_size
+		self.blobs = {}
+		self._resized = np.empty((height, width, 3), dtype=np.uint8)
+
+		# Older OpenCV versions return the output layer ids as a column vector, newer ones as a flat array
+		ln = self.net.getLayerNames()
+		self.layer_names = [ln[i - 1] for i in np.asarray(self.net.getUnconnectedOutLayers()).flatten()]
+
+	def set_input(self, frames):
+		"""
+			Resizes BGR frames into the preallocated blob of their batch size, RGB and scaled to 0-1 like cv2.dnn.blobFromImages.
+			returns the blob
+		"""
+		width, height = self.input_size
+		blob = self.blobs.get(len(frames))
+		if blob is None:
+			blob = self.blobs[len(frames)] = np.empty((len(frames), 3, height, width), dtype=np.float32)
+
+		for frame, planes in zip(frames, blob):
+			cv2.resize(frame, (width, height), dst=self._resized, interpolation=cv2.INTER_LINEAR)
+			np.multiply(self._resized[:, :, ::-1].transpose(2, 0, 1), 1 / 255.0, out=planes)
+		return blob
+
+	def forward(self, blob):
+		"""
+			Runs the network on a blob and returns the outputs of every output layer.
+		"""
+		self.net.setInput(blob)
+		return self.net.forward(self.layer_names)
+
+	def warm_up(self, runs=1):
+		"""
+			Runs the network on blank input so the first real frame does not pay for lazy initialization.
+		"""
+		width, height = self.input_size
+		blob = np.zeros((1, 3, height, width), dtype=np.float32)
+		for _ in range(runs):
+			self.forward(blob)
+
+class TfliteSession:
+	"""
+		tflite interpreter with everything needed per frame resolved once at startup.
+		interpreter: interpreter with allocated tensors
+		net: same as interpreter, the model object used by the detection classes
+		modelType: tpu-tiny-yolov3 or tpu-mobilenetv2
+		labels: dictionary mapping class ids to label names
+		input_shape: shape of the input tensor, (1, height, width, 3)
+		input_index: tensor index of the input
+		output_indices: tensor indices of the outputs
+		output_quantization: (scale, zero point) of every output
+		anchors, classes: anchors and class names of the tiny-yolo model
+		output_buffers: preallocated dequantized outputs
+		interpolation: cv2 interpolation used to resize frames into the input tensor
+		centered: whether the resized frame is centered in the input tensor (tiny-yolo) or placed in the top left corner (mobilenet)
+		pad_value: value of the letterbox padding around the resized frame
+	"""
+
+	def __init__(self, interpreter, modelType, labels_path="models/coco_labels.txt",
+				anchors_path="models/tiny_yolo_anchors.txt", classes_path="models/coco.names", interpolation=None):
+		"""
+			Resolves labels, anchors, tensor indices and quantization parameters and allocates buffers.
+			interpolation: cv2 interpolation flag, defaults to INTER_CUBIC for tiny-yolo and INTER_AREA for mobilenet
+		"""
+		self.interpreter = interpreter
+		self.net = interpreter
+		self.modelType = modelType
+		self.labels = load_labels(labels_path) if labels_path else {}
+
+		self.input_details = interpreter.get_input_details()
+		self.output_details = interpreter.get_output_details()
+		self.input_shape = self.input_details[0]["shape"]
+		self.input_index = self.input_details[0]["index"]
+		self.output_indices = [detail["index"] for detail in self.output_details]
+		self.output_quantization = [detail["quantization"] for detail in self.output_details]
+
+		self.anchors = None
+		self.classes = None
+		if modelType == "tpu-tiny-yolov3":
+			self.anchors = get_anchors(anchors_path)
+			self.classes = get_classes(classes_path)
+			self.centered = True
+			self.pad_value = 128
+			default_interpolation = cv2.INTER_CUBIC
+		else:
+			self.centered = False
+			self.pad_value = 0
+			default_interpolation = cv2.INTER_AREA
+
+		self.interpolation = default_interpolation if interpolation is None else interpolation
+		self.output_buffers = [np.empty(detail["shape"], dtype=np.float32) for detail in self.output_details]
+
+		# Letterbox geometry of the last frame written into the input tensor, the padding
+		# only needs to be written again when it changes
+		self._letterbox = None
+		self.preprocess_time = 0.0
+		self.forward_time = 0.0
+
+	def set_input(self, img):
+		"""
+			Resizes img with unchanged aspect ratio straight into the interpreter's input tensor.
+			returns the resize scale
+		"""
+		start = time.perf_counter()
+		height, width = self.input_shape[1:3]
+		ih, iw = img.shape[:2]
+		scale = min(width / iw, height / ih)
+		nw = int(iw * scale)
+		nh = int(ih * scale)
+		dx, dy = ((width - nw) // 2, (height - nh) // 2) if self.centered else (0, 0)
+
+		# The view must not outlive this call, the interpreter refuses to run while its buffers are referenced
+		tensor = detect.input_tensor(self.interpreter)
+		if self._letterbox != (nw, nh, dx, dy):
+			tensor.fill(self.pad_value)
+			self._letterbox = (nw, nh, dx, dy)
+
+		cv2.resize(img, (nw, nh), dst=tensor[dy:dy+nh, dx:dx+nw], interpolation=self.interpolation)
+		self.preprocess_time = time.perf_counter() - start
+		return scale
+
+	def invoke(self):
+		"""
+			Runs the model on the current content of the input tensor.
+		"""
+		start = time.perf_counter()
+		self.interpreter.invoke()
+		self.forward_time = time.perf_counter() - start
+
+	def dequantized_outputs(self):
+		"""
+			Returns the outputs of the last run as float32 arrays, written into the preallocated output buffers.
+		"""
+		for index, (scale, zero_point), buffer in zip(self.output_indices, self.output_quantization, self.output_buffers):
+			np.copyto(buffer, self.interpreter.get_tensor(index))
+
+			# A scale of 0 means the output is not quantized
+			if scale:
+				buffer -= zero_point
+				buffer *= scale
+		return self.output_buffers
+
+	def warm_up(self, runs=1):
+		"""
+			Runs the model on blank input so the first real frame does not pay for lazy initialization.
+		"""
+		detect.input_tensor(self.interpreter).fill(0)
+		self._letterbox = None
+		for _ in range(runs):
+			self.invoke()
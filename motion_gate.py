@@ -0,0 +1,86 @@
+# Python-specific imports
+import time
+import cv2
+import numpy as np
+
+class MotionGate:
+	"""
+		Cheap check run before a frame is handed to the detector. The frame is downscaled to grayscale and compared,
+		inside the ROI only, with the frame of the last detection. While the ROI stays static the detection is skipped
+		and the last result is kept, except every heartbeat seconds so a parked vehicle is still confirmed.
+		width: width the frames are downscaled to before comparing
+		pixel_threshold: 0-255 difference in gray level for a pixel to count as changed
+		min_changed: 0.0-1.0 fraction of the ROI pixels that must change for the ROI to count as moving
+		heartbeat: maximum number of seconds between two detections, 0 disables the heartbeat
+		passed, skipped: number of frames let through and held back
+	"""
+
+	def __init__(self, width=160, pixel_threshold=25, min_changed=0.01, heartbeat=5.0):
+		"""
+			Basic setup of a gate without reference frame, the first frame always passes.
+		"""
+		self.width = width
+		self.pixel_threshold = pixel_threshold
+		self.min_changed = min_changed
+		self.heartbeat = heartbeat
+		self.passed = 0
+		self.skipped = 0
+
+		self._reference = None
+		self._last_pass = 0.0
+		self._roi = None
+		self._mask = None
+		self._mask_pixels = 0
+
+	def __downscale(self, frame):
+		"""
+			Returns the frame as a small blurred grayscale image.
+		"""
+		height = max(1, int(round(frame.shape[0] * self.width / frame.shape[1])))
+		small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+		if small.ndim == 3:
+			small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+		return cv2.GaussianBlur(small, (5, 5), 0)
+
+	def __build_mask(self, prepared_roi, frame_shape, small_shape):
+		"""
+			Rasterizes every lane of the ROI at the downscaled resolution.
+		"""
+		scale = small_shape[1] / frame_shape[1]
+		polygons = [np.round(np.asarray(lane.coordinates) * scale).astype(np.int32) for lane in prepared_roi.lanes]
+		self._mask = np.zeros(small_shape, dtype=np.uint8)
+		cv2.fillPoly(self._mask, polygons, 1)
+		self._mask_pixels = max(1, int(self._mask.sum()))
+		self._roi = prepared_roi
+
+	def changed_fraction(self, small):
+		"""
+			Fraction of the ROI pixels that differ from the reference frame.
+		"""
+		diff = cv2.absdiff(small, self._reference)
+		changed = (diff > self.pixel_threshold) & self._mask.astype(bool)
+		return np.count_nonzero(changed) / self._mask_pixels
+
+	def should_detect(self, frame, prepared_roi, now=None):
+		"""
+			Whether the frame must go through the detector. The frame becomes the new reference when it does.
+			frame: full resolution frame
+			prepared_roi: PreparedROISet of the camera in frame pixels, a change in any lane lets the frame through
+		"""
+		now = time.time() if now is None else now
+		small = self.__downscale(frame)
+
+		# A new ROI or resolution invalidates the reference, the last result was computed for something else
+		reset = prepared_roi is not self._roi or self._reference is None or self._reference.shape != small.shape
+		if reset:
+			self.__build_mask(prepared_roi, frame.shape, small.shape)
+
+		due = self.heartbeat > 0 and now - self._last_pass >= self.heartbeat
+		if reset or due or self.changed_fraction(small) >= self.min_changed:
+			self._reference = small
+			self._last_pass = now
+			self.passed += 1
+			return True
+
+		self.skipped += 1
+		return False
@@ -0,0 +1,315 @@
+# Python-specific imports
+import collections
+import itertools
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+# Package-specific imports
+from YoloVideo import VehicleDetections
+
+# Number of PreparedROISets each worker keeps, the least recently used one is dropped first
+ROI_CACHE_SIZE = 64
+
+class InferenceProcessPool:
+	"""
+		Runs detection in separate processes, each holding its own copy of the model, so pre- and post-processing of
+		different cameras run in parallel instead of behind one interpreter lock. Frames are not pickled: the parent writes
+		them into a slot of one shared memory block and only sends the slot number, the worker writes the debug image back
+		into the same slot. Frames larger than a slot are sent through the task queue instead.
+		Every worker has its own task queue, frames go to the ready worker with the fewest frames in flight. A worker that
+		dies fails its frames, gives their slots back and is started again.
+		Used by the DetectionService in place of a detector.
+		detector_config: keyword arguments of utils.build_detector, every worker builds its detector from them
+		processes: number of worker processes
+		slots_per_process: number of frames that can be in flight per worker
+		max_frame_shape: largest (height, width, channels) uint8 frame that fits in a slot
+		timeout: seconds to wait for a free slot or for a frame to be detected before giving up on it
+		restarts: number of workers started again after they died
+	"""
+
+	def __init__(self, detector_config, processes=2, slots_per_process=2, max_frame_shape=(1080, 1920, 3), timeout=10.0, startup_timeout=300.0):
+		"""
+			Creates the shared memory, starts the workers and waits until every one of them has loaded its model.
+		"""
+		self.context = multiprocessing.get_context("spawn")
+		self.detector_config = detector_config
+		self.timeout = timeout
+		self.slot_bytes = int(np.prod(max_frame_shape))
+		self.num_slots = max(1, processes * slots_per_process)
+		self.shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * self.num_slots)
+		self.free_slots = queue.Queue()
+		for slot in range(self.num_slots):
+			self.free_slots.put(slot)
+
+		self.results = self.context.Queue()
+		self.pending = {}
+		self.restarts = 0
+		self._task_ids = itertools.count()
+		self._lock = threading.Lock()
+
+		self.processes = [None] * processes
+		self.task_queues = [None] * processes
+		self.ready = [False] * processes
+		self._running = False
+		for index in range(processes):
+			self.__start_worker(index)
+
+		try:
+			self.__wait_ready(startup_timeout)
+		except Exception:
+			self.close()
+			raise
+
+		self._running = True
+		self._dispatcher = threading.Thread(target=self.__dispatch, daemon=True)
+		self._dispatcher.start()
+
+	def __start_worker(self, index):
+		"""
+			Starts the worker process of a slot of the pool with a fresh task queue, it is ready once its model is loaded.
+		"""
+		tasks = self.context.Queue()
+		process = self.context.Process(target=_worker_main, daemon=True,
+			args=(self.detector_config, self.shm.name, self.slot_bytes, tasks, self.results, index))
+		process.start()
+		self.processes[index] = process
+		self.task_queues[index] = tasks
+		self.ready[index] = False
+
+	def __wait_ready(self, timeout):
+		"""
+			Waits for the ready message of every worker, raises if one of them could not build its detector.
+		"""
+		deadline = time.time() + timeout
+		for _ in self.processes:
+			try:
+				_, ok, (index, message) = self.results.get(timeout=max(0.0, deadline - time.time()))
+			except queue.Empty:
+				raise RuntimeError("inference workers did not start within {} seconds".format(timeout))
+			if not ok:
+				raise RuntimeError("inference worker failed to start: {}".format(message))
+			self.ready[index] = True
+
+	def detect_batch(self, frames, cameras):
+		"""
+			Runs detection on several frames at once, frames[i] comes from cameras[i].
+			returns a list with the ((carAmount, debug image), VehicleDetections, stage times) of each frame
+		"""
+		waiting = []
+		for frame, camera in zip(frames, cameras):
+			roi = tuple((lane.name, tuple(tuple(coord) for coord in lane.coordinates), lane.thresh)
+				for lane in camera.get_prepared_roi().lanes)
+			task = _Task()
+			if frame.dtype == np.uint8 and frame.nbytes <= self.slot_bytes:
+				try:
+					task.slot = self.free_slots.get(timeout=self.timeout)
+				except queue.Empty:
+					raise RuntimeError("no free frame slot within {} seconds".format(self.timeout))
+				np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=task.slot * self.slot_bytes)[...] = frame
+
+			with self._lock:
+				task.worker = self.__pick_worker()
+				if task.worker is None:
+					if task.slot is not None:
+						self.free_slots.put(task.slot)
+					raise RuntimeError("no inference worker is running")
+				task_id = next(self._task_ids)
+				self.pending[task_id] = task
+				tasks = self.task_queues[task.worker]
+
+			if task.slot is not None:
+				tasks.put((task_id, task.slot, frame.shape, None, roi))
+			else:
+				tasks.put((task_id, None, frame.shape, frame, roi))
+			waiting.append(task)
+
+		results = []
+		for task in waiting:
+			if not task.done.wait(self.timeout):
+				# The task stays pending so its slot is freed if the worker answers late
+				raise RuntimeError("inference worker did not answer within {} seconds".format(self.timeout))
+			if task.error is not None:
+				raise RuntimeError(task.error)
+			results.append(task.result)
+		return results
+
+	def __pick_worker(self):
+		"""
+			Returns the index of the ready worker with the fewest frames in flight, or of any live worker while none is ready.
+			None when every worker is gone. Called with the lock held.
+		"""
+		load = [0] * len(self.processes)
+		for task in self.pending.values():
+			load[task.worker] += 1
+		alive = [index for index, process in enumerate(self.processes) if process is not None]
+		candidates = [index for index in alive if self.ready[index]] or alive
+		return min(candidates, key=lambda index: load[index]) if candidates else None
+
+	def __check_workers(self):
+		"""
+			Fails the frames of workers that died, gives their slots back and starts the workers again.
+			A worker that died before it was ready could not load its model and is not started again.
+		"""
+		for index, process in enumerate(self.processes):
+			if process is None or process.is_alive():
+				continue
+
+			with self._lock:
+				lost = [task_id for task_id, task in self.pending.items() if task.worker == index]
+				tasks = [self.pending.pop(task_id) for task_id in lost]
+				restart = self.ready[index]
+				if restart:
+					self.__start_worker(index)
+					self.restarts += 1
+				else:
+					self.processes[index] = None
+
+			print("[ERROR] inference worker {} died with exit code {}, {} frames lost{}".format(
+				index, process.exitcode, len(tasks), ", restarting it" if restart else ""))
+			for task in tasks:
+				task.error = "inference worker died"
+				if task.slot is not None:
+					self.free_slots.put(task.slot)
+				task.done.set()
+
+	def __dispatch(self):
+		"""
+			Hands the results coming back from the workers to the waiting tasks. Debug images are copied out of their slot
+			here so the slot is free again as soon as the worker is done with it. Also watches the workers.
+		"""
+		while self._running:
+			self.__check_workers()
+			try:
+				task_id, ok, payload = self.results.get(timeout=0.5)
+			except queue.Empty:
+				continue
+			except (EOFError, OSError):
+				return
+
+			if task_id is None:
+				# Ready message of a worker that was started again
+				index, message = payload
+				if ok:
+					self.ready[index] = True
+				else:
+					print("[ERROR] inference worker {} failed to start: {}".format(index, message))
+				continue
+
+			with self._lock:
+				task = self.pending.pop(task_id, None)
+			if task is None:
+				continue
+
+			if ok:
+				num_cars, debug_frame, detections, stage_times = payload
+				if isinstance(debug_frame, tuple):
+					debug_frame = np.ndarray(debug_frame, dtype=np.uint8, buffer=self.shm.buf, offset=task.slot * self.slot_bytes).copy()
+				task.result = ((num_cars, debug_frame), VehicleDetections(*detections), stage_times)
+			else:
+				task.error = payload
+			if task.slot is not None:
+				self.free_slots.put(task.slot)
+			task.done.set()
+
+	def close(self, timeout=2.0):
+		"""
+			Stops the workers and frees the shared memory.
+		"""
+		self._running = False
+		for process, tasks in zip(self.processes, self.task_queues):
+			if process is not None:
+				tasks.put(None)
+		for process in self.processes:
+			if process is None:
+				continue
+			process.join(timeout)
+			if process.is_alive():
+				process.terminate()
+		self.shm.close()
+		self.shm.unlink()
+
+class _Task:
+	"""
+		A frame waiting to be detected by a worker.
+	"""
+
+	def __init__(self):
+		self.slot = None
+		self.worker = None
+		self.result = None
+		self.error = None
+		self.done = threading.Event()
+
+class _RoiCamera:
+	"""
+		Stands in for the camera in the workers, only the PreparedROISet is needed by set_frame_and_roi.
+	"""
+
+	def __init__(self, prepared_roi):
+		self.prepared_roi = prepared_roi
+
+	def get_prepared_roi(self):
+		return self.prepared_roi
+
+def _worker_main(detector_config, shm_name, slot_bytes, tasks, results, index):
+	"""
+		Loop run by each worker process: builds the detector, then detects the frames of the tasks until it gets None.
+		index: position of the worker in the pool, sent back with its ready message
+	"""
+	# Ctrl+C is handled by the app, which closes the pool
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	from find_intersect import PreparedROI, PreparedROISet
+	from utils import build_detector
+
+	try:
+		detector = build_detector(**detector_config)
+		shm = shared_memory.SharedMemory(name=shm_name)
+	except Exception as e:
+		results.put((None, False, (index, "{}: {}".format(type(e).__name__, e))))
+		return
+	results.put((None, True, (index, None)))
+
+	# PreparedROISet is rebuilt only when a lane of a camera changes, sets of edited lanes age out of the cache
+	cameras = collections.OrderedDict()
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+
+		task_id, slot, shape, frame, roi = task
+		try:
+			if frame is None:
+				frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+			camera = cameras.get(roi)
+			if camera is None:
+				camera = cameras[roi] = _RoiCamera(PreparedROISet([PreparedROI([list(coord) for coord in coordinates], thresh, name)
+					for name, coordinates, thresh in roi]))
+				if len(cameras) > ROI_CACHE_SIZE:
+					cameras.popitem(last=False)
+			else:
+				cameras.move_to_end(roi)
+
+			detector.set_frame_and_roi(frame, camera)
+			num_cars, debug_frame = detector.detect_intersections()
+			detections = detector.vehicle_detections
+
+			# The debug image goes back through the slot of the frame when it fits
+			debug_frame = np.ascontiguousarray(debug_frame, dtype=np.uint8)
+			if slot is not None and debug_frame.nbytes <= slot_bytes:
+				np.ndarray(debug_frame.shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)[...] = debug_frame
+				debug_frame = debug_frame.shape
+
+			detections = (np.asarray(detections.boxes, dtype=np.int32), np.asarray(detections.accepted, dtype=bool),
+				np.asarray(detections.lanes, dtype=bool), tuple(detections.lane_names))
+			results.put((task_id, True, (int(num_cars), debug_frame, detections, dict(detector.stage_times))))
+		except Exception as e:
+			results.put((task_id, False, "{}: {}".format(type(e).__name__, e)))
+
+	# The detector still holds views on the shared memory, it is released with the process
+	del detector
@@ -0,0 +1,240 @@
+# Python-specific imports
+import collections
+import threading
+import time
+
+# Window in seconds used to compute the achieved detection rate of a camera
+FPS_WINDOW = 5.0
+
+class CameraSlot:
+	"""
+		Latest-frame slot and scheduling state for one camera.
+		name: key of the camera
+		weight: share of the detector this camera gets under the weighted policy
+		min_fps: minimum detections per second, the camera is served first when it falls behind this rate
+		max_staleness: frames older than this many seconds are dropped instead of detected, None to keep them
+	"""
+
+	def __init__(self, name, weight=1.0, min_fps=0.0, max_staleness=None):
+		"""
+			Basic setup of an empty slot.
+		"""
+		self.name = name
+		self.weight = weight if weight > 0 else 1.0
+		self.min_fps = min_fps
+		self.max_staleness = max_staleness
+		self.item = None
+		self.submitted_at = 0.0
+		self.last_served = 0.0
+		self.virtual_time = 0.0
+		self.served = collections.deque()
+		self.replaced = 0
+		self.stale = 0
+
+	def deadline(self):
+		"""
+			Time by which this camera must be served to keep its minimum detection rate.
+		"""
+		if self.min_fps <= 0:
+			return None
+		return self.last_served + 1.0 / self.min_fps
+
+	def achieved_fps(self, now):
+		"""
+			Number of detections per second over the last FPS_WINDOW seconds.
+		"""
+		while self.served and now - self.served[0] > FPS_WINDOW:
+			self.served.popleft()
+		return len(self.served) / FPS_WINDOW
+
+class DetectionScheduler:
+	"""
+		Shares one detector between many cameras. Every camera has a latest-frame slot, newer frames replace
+		older ones that have not been served yet. Slots are served round-robin or by weight, cameras that fall behind
+		their minimum rate are served first and frames older than their staleness deadline are dropped.
+	"""
+
+	POLICIES = ("round_robin", "weighted")
+
+	def __init__(self, process, policy="round_robin", workers=1, batch_size=1):
+		"""
+			process: callback(batch) that runs the detector, batch is a list of (name, item) pairs from different cameras
+			policy: round_robin or weighted
+			workers: number of threads serving the detector
+			batch_size: maximum number of cameras served by a single call to process
+		"""
+		if policy not in self.POLICIES:
+			raise ValueError("Unknown scheduling policy {}, choose between {}".format(policy, ", ".join(self.POLICIES)))
+
+		self.process = process
+		self.policy = policy
+		self.num_workers = workers
+		self.batch_size = max(1, batch_size)
+		self.slots = collections.OrderedDict()
+		lock = threading.Lock()
+		self.condition = threading.Condition(lock)
+		# Notified whenever a waiting frame leaves its slot, see wait_taken
+		self.taken = threading.Condition(lock)
+		self.threads = []
+		self.running = False
+		self._last_index = -1
+
+	def add_camera(self, name, weight=1.0, min_fps=0.0, max_staleness=None):
+		"""
+			Registers a camera with the scheduler.
+		"""
+		with self.condition:
+			slot = CameraSlot(name, weight, min_fps, max_staleness)
+			# Start at the current minimum so a new camera does not get a burst of detections
+			slot.virtual_time = min((s.virtual_time for s in self.slots.values()), default=0.0)
+			self.slots[name] = slot
+
+	def remove_camera(self, name):
+		"""
+			Unregisters a camera and drops its pending frame.
+		"""
+		with self.condition:
+			self.slots.pop(name, None)
+			self.taken.notify_all()
+
+	def submit(self, name, item):
+		"""
+			Puts a frame into the camera's slot, replacing a frame that is still waiting.
+		"""
+		with self.condition:
+			slot = self.slots.get(name)
+			if slot is None:
+				return
+
+			if slot.item is not None:
+				slot.replaced += 1
+
+			slot.item = item
+			slot.submitted_at = time.time()
+			self.condition.notify()
+
+	def wait_taken(self, name, timeout=None):
+		"""
+			Waits until the frame waiting in the camera's slot was taken by a serving thread or dropped.
+			returns False on timeout
+		"""
+		with self.taken:
+			return self.taken.wait_for(lambda: not self.running or name not in self.slots or self.slots[name].item is None, timeout)
+
+	def start(self):
+		"""
+			Starts the threads serving the detector.
+		"""
+		self.running = True
+		for i in range(self.num_workers):
+			thread = threading.Thread(target=self.__serve, daemon=True)
+			thread.start()
+			self.threads.append(thread)
+
+	def stop(self, timeout=2.0):
+		"""
+			Stops the serving threads.
+		"""
+		with self.condition:
+			self.running = False
+			self.condition.notify_all()
+			self.taken.notify_all()
+
+		for thread in self.threads:
+			thread.join(timeout)
+		self.threads = []
+
+	def stats(self):
+		"""
+			Returns per-camera scheduling statistics: achieved detection fps, replaced and stale frames.
+		"""
+		now = time.time()
+		with self.condition:
+			return {
+				slot.name: {
+					"detection_fps": slot.achieved_fps(now),
+					"replaced_frames": slot.replaced,
+					"stale_frames": slot.stale,
+					"waiting": slot.item is not None,
+				}
+				for slot in self.slots.values()
+			}
+
+	def __next_slot(self, now):
+		"""
+			Picks the next slot to serve among the slots holding a frame, or None if every slot is empty.
+		"""
+		ready = []
+		for slot in self.slots.values():
+			if slot.item is None:
+				continue
+
+			# Drop frames that waited past the camera's staleness deadline
+			if slot.max_staleness is not None and now - slot.submitted_at > slot.max_staleness:
+				slot.item = None
+				slot.stale += 1
+				self.taken.notify_all()
+				continue
+
+			ready.append(slot)
+
+		if not ready:
+			return None
+
+		# Cameras behind their minimum rate go first, the most overdue one first
+		overdue = [slot for slot in ready if slot.deadline() is not None and slot.deadline() <= now]
+		if overdue:
+			return min(overdue, key=lambda slot: slot.deadline())
+
+		if self.policy == "weighted":
+			return min(ready, key=lambda slot: slot.virtual_time)
+
+		# Round robin: first ready slot after the last one served
+		names = list(self.slots)
+		ready_names = set(slot.name for slot in ready)
+		for offset in range(1, len(names) + 1):
+			name = names[(self._last_index + offset) % len(names)]
+			if name in ready_names:
+				return self.slots[name]
+
+	def __take(self, slot, now):
+		"""
+			Removes the frame from a slot that is about to be served and updates its scheduling state.
+		"""
+		item = slot.item
+		slot.item = None
+		self.taken.notify_all()
+		slot.last_served = now
+		slot.virtual_time += 1.0 / slot.weight
+		slot.served.append(now)
+		self._last_index = list(self.slots).index(slot.name)
+		return slot.name, item
+
+	def __serve(self):
+		"""
+			Loop run by each serving thread: wait for frames, pick up to batch_size slots and run the detector on them.
+		"""
+		while True:
+			with self.condition:
+				slot = None
+				while self.running:
+					slot = self.__next_slot(time.time())
+					if slot is not None:
+						break
+					self.condition.wait()
+
+				if not self.running:
+					return
+
+				now = time.time()
+				batch = [self.__take(slot, now)]
+				while len(batch) < self.batch_size:
+					slot = self.__next_slot(now)
+					if slot is None:
+						break
+					batch.append(self.__take(slot, now))
+
+			try:
+				self.process(batch)
+			except Exception as e:
+				print("[ERROR] detection failed on cameras {}: {}".format(", ".join(str(name) for name, _ in batch), e))
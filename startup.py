@@ -0,0 +1,85 @@
+# Python-specific imports
+import threading
+import time
+
+class StartupTimer:
+	"""
+		Measures how long the app takes to come up, phase by phase, against a time budget.
+		Phases are timed with phase(), milestones such as the moment the web server starts are marked with mark().
+		budget: seconds the app may take until every camera is detecting
+		started_at: time the process started, phases and milestones are reported relative to it
+		phases: seconds spent in each phase
+		milestones: seconds from started_at to each milestone
+	"""
+
+	def __init__(self, budget=30.0, started_at=None):
+		"""
+			Basic setup of the timer, nothing is measured until the first phase.
+		"""
+		self.budget = budget
+		self.started_at = time.time() if started_at is None else started_at
+		self.phases = {}
+		self.milestones = {}
+		self._lock = threading.Lock()
+
+	def phase(self, name):
+		"""
+			Returns a context manager timing the block it wraps as a phase.
+		"""
+		return _Phase(self, name)
+
+	def record(self, name, seconds):
+		"""
+			Records the duration of a phase.
+		"""
+		with self._lock:
+			self.phases[name] = seconds
+
+	def mark(self, name):
+		"""
+			Records a milestone at the current time.
+		"""
+		with self._lock:
+			self.milestones[name] = time.time() - self.started_at
+
+	def report(self):
+		"""
+			Prints the phases and milestones, with a warning when the app came up later than the budget.
+			returns the elapsed seconds since started_at
+		"""
+		elapsed = time.time() - self.started_at
+		with self._lock:
+			phases = ", ".join("{} {:.2f}s".format(name, seconds) for name, seconds in self.phases.items())
+			milestones = ", ".join("{} at {:.2f}s".format(name, seconds) for name, seconds in self.milestones.items())
+
+		print("[INFO] startup took {:.2f}s of a {:.1f}s budget ({}; {})".format(elapsed, self.budget, phases, milestones))
+		if elapsed > self.budget:
+			print("[WARNING] startup exceeded its budget by {:.2f}s".format(elapsed - self.budget))
+		return elapsed
+
+	def gauges(self):
+		"""
+			Returns the phases and milestones as (name, labels, value) gauges for the metrics.
+		"""
+		with self._lock:
+			gauges = [("startup_phase_seconds", {"phase": name}, seconds) for name, seconds in self.phases.items()]
+			gauges.extend(("startup_milestone_seconds", {"milestone": name}, seconds) for name, seconds in self.milestones.items())
+		gauges.append(("startup_budget_seconds", {}, self.budget))
+		return gauges
+
+class _Phase:
+	"""
+		Context manager recording the time spent in its block as a phase of a StartupTimer.
+	"""
+
+	def __init__(self, timer, name):
+		self.timer = timer
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.timer.record(self.name, time.perf_counter() - self.start)
+		return False
@@ -0,0 +1,113 @@
+# Python-specific imports
+import threading
+import time
+
+# Package-specific imports
+from utils import prepare_frame_for_display
+from metrics import METRICS
+
+class FrameHub:
+	"""
+		Broadcasts the frames of one camera to any number of viewers. Every new frame is resized, overlaid and
+		JPEG encoded at most once, by whichever viewer asks for it first, and all viewers stream that same bytes object.
+		A viewer that falls behind skips straight to the newest frame instead of queueing old ones.
+		camera_name: name written on the frame overlay
+		stage: name under which the encoding time is recorded in the metrics
+		rate: optional name under which every encoded frame counts towards an achieved frame rate in the metrics
+	"""
+
+	def __init__(self, camera_name, stage="encode", rate=None):
+		"""
+			Basic setup of an empty hub.
+		"""
+		self.camera_name = camera_name
+		self.stage = stage
+		self.rate = rate
+		self.condition = threading.Condition()
+		self.frame = None
+		self.frame_id = 0
+		self.encoded = None
+		self.encoded_id = 0
+		self.viewers = 0
+		self.listeners = []
+		self._encode_lock = threading.Lock()
+
+	def publish(self, frame):
+		"""
+			Makes frame the newest frame of the hub and wakes up the viewers.
+		"""
+		with self.condition:
+			self.frame = frame
+			self.frame_id += 1
+			self.condition.notify_all()
+			listeners = list(self.listeners)
+
+		for listener in listeners:
+			listener()
+
+	def add_listener(self, listener):
+		"""
+			Registers a callback run on the publishing thread after every new frame, used by viewers that do not block on the condition.
+		"""
+		with self.condition:
+			self.listeners.append(listener)
+			self.viewers += 1
+
+	def remove_listener(self, listener):
+		"""
+			Unregisters a callback added with add_listener.
+		"""
+		with self.condition:
+			self.listeners.remove(listener)
+			self.viewers -= 1
+
+	def latest(self):
+		"""
+			Returns (frame id, encoded frame) of the newest frame, encoding it if no viewer has done so yet.
+		"""
+		with self._encode_lock:
+			with self.condition:
+				frame, frame_id = self.frame, self.frame_id
+
+			if frame is None:
+				return 0, None
+
+			if self.encoded_id != frame_id:
+				start = time.perf_counter()
+				self.encoded = prepare_frame_for_display(frame, self.camera_name)
+				self.encoded_id = frame_id
+				METRICS.observe(self.stage, self.camera_name, time.perf_counter() - start)
+				if self.rate is not None:
+					METRICS.tick(self.rate, self.camera_name)
+
+			return self.encoded_id, self.encoded
+
+	def wait_for_frame(self, last_id, timeout=1.0):
+		"""
+			Blocks until a frame newer than last_id is published or the timeout expires.
+		"""
+		with self.condition:
+			return self.condition.wait_for(lambda: self.frame_id != last_id, timeout)
+
+	def subscribe(self):
+		"""
+			Generator yielding every new encoded frame to one viewer, skipping frames published while the viewer was busy.
+		"""
+		with self.condition:
+			self.viewers += 1
+
+		try:
+			last_id = 0
+			while True:
+				if not self.wait_for_frame(last_id):
+					continue
+
+				frame_id, encoded = self.latest()
+				if encoded is None or frame_id == last_id:
+					continue
+
+				last_id = frame_id
+				yield encoded
+		finally:
+			with self.condition:
+				self.viewers -= 1
@@ -0,0 +1,112 @@
+# Python-specific imports
+import random
+import threading
+import time
+
+class Backoff:
+	"""
+		Exponential backoff with jitter, so many cameras behind one broken link do not retry in lockstep.
+		initial: seconds before the second attempt, doubled after every failed attempt up to maximum
+	"""
+
+	def __init__(self, initial=1.0, maximum=60.0):
+		self.maximum = maximum
+		self.delay = initial
+
+	def next_wait(self):
+		"""
+			Returns the seconds to wait before the next attempt and doubles the delay.
+		"""
+		wait = self.delay * random.uniform(0.5, 1.5)
+		self.delay = min(self.delay * 2, self.maximum)
+		return wait
+
+class StreamWatchdog(threading.Thread):
+	"""
+		Watches one camera and reconnects it in the background once it stops delivering frames. Failed attempts are retried
+		with a Backoff.
+		Until the camera is back, its consumers keep getting the last good frame tagged as stale.
+		camera: Camera or Video with stalled(), reconnect() and close_stream() methods
+		check_interval: seconds between two checks of the camera
+		backoff: seconds before the second attempt, doubled after every failed attempt up to max_backoff
+		reconnecting: whether the camera is currently being reconnected
+		reconnects: number of successful reconnections
+		attempts: number of reconnection attempts
+		downtime: seconds spent reconnecting, not counting the current outage
+	"""
+
+	def __init__(self, camera, check_interval=0.5, backoff=1.0, max_backoff=60.0):
+		"""
+			Basic setup of the watchdog, it is started with start().
+		"""
+		super(StreamWatchdog, self).__init__(daemon=True)
+		self.camera = camera
+		self.check_interval = check_interval
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.reconnecting = False
+		self.reconnects = 0
+		self.attempts = 0
+		self.downtime = 0.0
+		self.down_since = None
+		self._stop_event = threading.Event()
+
+	def stop(self):
+		"""
+			Stops watching, an attempt in progress is abandoned once it returns.
+		"""
+		self._stop_event.set()
+
+	def stats(self):
+		"""
+			Returns whether the camera is reconnecting, the reconnection counters and the total downtime in seconds.
+		"""
+		down_since = self.down_since
+		return {
+			"reconnecting": self.reconnecting,
+			"reconnects": self.reconnects,
+			"reconnect_attempts": self.attempts,
+			"downtime": self.downtime + (time.time() - down_since if down_since is not None else 0.0),
+		}
+
+	def run(self):
+		"""
+			Checks the camera every check_interval and reconnects it when it stalled.
+		"""
+		while not self._stop_event.wait(self.check_interval):
+			try:
+				if self.camera.stalled():
+					self.__reconnect()
+			except Exception as e:
+				print("[ERROR] watchdog of camera {} failed: {}".format(self.camera.url, e))
+
+	def __reconnect(self):
+		"""
+			Reconnects until it works or the watchdog is stopped.
+		"""
+		self.down_since = time.time()
+		self.reconnecting = True
+		print("[WARNING] camera {} stalled, reconnecting".format(self.camera.url))
+
+		backoff = Backoff(self.backoff, self.max_backoff)
+		while not self._stop_event.is_set():
+			self.attempts += 1
+			try:
+				self.camera.reconnect()
+				break
+			except Exception as e:
+				wait = backoff.next_wait()
+				print("[ERROR] could not reconnect camera {}: {}, retrying in {:.1f}s".format(self.camera.url, e, wait))
+				if self._stop_event.wait(wait):
+					break
+
+		if self._stop_event.is_set():
+			# Stopped while reconnecting, a stream opened in the meantime is not used
+			self.camera.close_stream()
+			return
+
+		self.downtime += time.time() - self.down_since
+		self.down_since = None
+		self.reconnects += 1
+		self.reconnecting = False
+		print("[INFO] camera {} reconnected".format(self.camera.url))
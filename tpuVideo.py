@@ -1,13 +1,10 @@
 # Python-specific imports
-import numpy as np
 import time
-import cv2
-import matplotlib.pyplot as plt
 
 # Package-specific imports
 from detect_image import tpu_mobilenet_detection
 from tpu_inference_tiny_yolo import tpu_tiny_yolo_detection
-from tpu_utils_tiny_yolo import get_anchors, get_classes
+from model_session import TfliteSession
 from YoloVideo import YoloVideo
 
 class tpuVideo(YoloVideo):
@@ -15,49 +12,71 @@ class tpuVideo(YoloVideo):
     Detection model to identify cars and trucks within a specific region of interest (ROI)
   """
 
-  def __init__(self, net, modelType):
+  def __init__(self, net, modelType, crop_to_roi=False, crop_padding=0.1):
     """
 		Inherits variables from the YoloVideo class.
+		net: TfliteSession, or an interpreter from make_interpreter() that gets wrapped in one
 		self.modelType: The tpu model to use for detection. Choose between tpu-mobilenetv2 or tpu-tiny-yolov3.
+		crop_to_roi, crop_padding: letterbox only the padded bounding rectangle of the ROI, see YoloVideo
     """
-    super(tpuVideo, self).__init__(net)
     self.modelType = modelType # choose tiny-yolo or mobilenet
+    super(tpuVideo, self).__init__(net, crop_to_roi=crop_to_roi, crop_padding=crop_padding)
+
+  def build_session(self, net):
+    """
+    	Return the tflite session used for inference, anchors, classes and tensor details are resolved once here.
+    """
+    if isinstance(net, TfliteSession):
+        return net
+    return TfliteSession(net, self.modelType, labels_path=self.get_yolo_labels())
 
   def detect_in_frame(self, output_time=False):
     """
     	Perform inference based on the tpu model and return an object containing id, confidence, and
     	coordinates of bounding boxes in the frame.
     """
+    start = time.perf_counter()
     if self.modelType == "tpu-mobilenetv2":
-        objs, labeledImage = tpu_mobilenet_detection(self.net, 
-            labels=self.labels, image=self.frame, pickedClass=self.pickedClass,
+        objs, labeledImage = tpu_mobilenet_detection(self.session, 
+            labels=self.labels, image=self.inference_frame, pickedClass=self.pickedClass,
             threshold=self.confidence, labeledOutputImage=False)
 
     elif self.modelType == "tpu-tiny-yolov3": 
-        anchorsPath = "models/tiny_yolo_anchors.txt"
-        classesPath = "models/coco.names"
-
-        anchors = get_anchors(anchorsPath)
-        classes = get_classes(classesPath)
-        
-        objs, labeledImage = tpu_tiny_yolo_detection(self.net, anchors, 
-            self.frame, classes, self.confidence, labeledOutputImage=False)
+        objs, labeledImage = tpu_tiny_yolo_detection(self.session, 
+            self.inference_frame, self.confidence, labeledOutputImage=False)
 
+    # The session times its own steps, the rest is output decoding (and nms for tiny-yolo)
+    self.stage_times["preprocess"] = self.session.preprocess_time
+    self.stage_times["forward"] = self.session.forward_time
+    self.stage_times["decode"] = time.perf_counter() - start - self.session.preprocess_time - self.session.forward_time
     return objs
 
-  def extract_detection_information(self):
+  def detect_in_frames(self, frames, output_time=False):
+    """
+    	The tflite models take a single image, so frames are run one after the other.
+    	returns a list with the detected objects of each frame
+    """
+    outputs = []
+    for frame in frames:
+        self.inference_frame = frame
+        outputs.append(self.detect_in_frame(output_time))
+    return outputs
+
+  def extract_detection_information(self, output=None):
     """
     	returns lists of detected bounding boxes, confidences, and class IDs, respectively
+    	output: objects already detected in self.frame, runs detect_in_frame when None
     """
 
     # initialize our lists of detected bounding boxes, confidences,and class IDs, respectively
     boxes = []
     confidences= []
     classIDs = []
-    output = self.detect_in_frame()
+    if output is None:
+        output = self.detect_in_frame()
 
-    #grab frame dimensions
-    (H,W) = self.frame.shape[:2]
+    # boxes are relative to the inference frame, move them back into the full frame
+    (offsetX, offsetY) = self.crop_offset
 
     # loop over each of the detections
     for detection in output:
@@ -71,8 +90,8 @@ class tpuVideo(YoloVideo):
               # scale the bounding box coordinates back relative to
               # the size of the image, keeping in mind that YOLO height
               
-              x = int(detection.bbox.xmin)
-              y = int(detection.bbox.ymin)
+              x = int(detection.bbox.xmin) + offsetX
+              y = int(detection.bbox.ymin) + offsetY
               width = int(detection.bbox.xmax - detection.bbox.xmin)
               height = int(detection.bbox.ymax - detection.bbox.ymin)
 
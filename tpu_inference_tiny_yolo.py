@@ -2,10 +2,7 @@
 
 # Python-specific imports
 import numpy as np
-import tflite_runtime.interpreter as tflite
-import sys
 import cv2
-from time import time
 import collections
 
 # Package-specific imports
@@ -16,6 +13,8 @@ EDGETPU_SHARED_LIB = "libedgetpu.so.1"
 
 def make_interpreter(model_path, edge_tpu=False):
 	"""Load the TF-Lite model and delegate to Edge TPU"""
+	import tflite_runtime.interpreter as tflite
+
 	if edge_tpu:
 		interpreter = tflite.Interpreter(model_path=model_path,
 						experimental_delegates=[tflite.load_delegate(EDGETPU_SHARED_LIB)])
@@ -24,37 +23,29 @@ def make_interpreter(model_path, edge_tpu=False):
 
 	return interpreter
 
-def inference(interpreter, img, anchors, n_classes, threshold):
-	"""Run YOLO inference on the image, returns detected boxes"""
-	
-	input_details, output_details, net_input_shape = get_interpreter_details(interpreter)
+def inference(session, img, threshold):
+	"""
+	Run YOLO inference on the image, returns detected boxes
+	session: TfliteSession holding the interpreter, anchors and classes
+	"""
+	anchors = session.anchors
+	n_classes = len(session.classes)
+	net_input_shape = session.input_shape
 
 	img_orig_shape = img.shape
-	# Crop frame to network input shape
-	img = letterbox_image(img.copy(), (416, 416))
-	# Add batch dimension
-	img = np.expand_dims(img, 0)
+	# Letterbox the frame to the network input shape, straight into the input tensor
+	session.set_input(img)
 
-	# Set input tensor
-	interpreter.set_tensor(input_details[0]['index'], img)
 	###start = time()
 
 	# Run model
-	interpreter.invoke()
+	session.invoke()
 
 	###inf_time = time() - start
 	###print(f"Net forward-pass time: {inf_time*1000} ms.")
 
-	# Retrieve outputs of the network
-	out1 = interpreter.get_tensor(output_details[0]['index'])
-	out2 = interpreter.get_tensor(output_details[1]['index'])
-
-	# If this is a quantized model, dequantize the outputs
-	# Dequantize output
-	o1_scale, o1_zero = output_details[0]['quantization']
-	out1 = (out1.astype(np.float32) - o1_zero) * o1_scale
-	o2_scale, o2_zero = output_details[1]['quantization']
-	out2 = (out2.astype(np.float32) - o2_zero) * o2_scale
+	# Retrieve the dequantized outputs of the network
+	out1, out2 = session.dequantized_outputs()
 
 	# Get boxes from outputs of network
 	###start = time()
@@ -137,26 +128,20 @@ def get_output(boxes, class_ids, scores, score_threshold):
 
 	return [make(i) for i in range(count) if scores[i] >= score_threshold]
 	
-def tpu_tiny_yolo_detection(interpreter, anchors, img, classes, threshold, labeledOutputImage=False):
+def tpu_tiny_yolo_detection(session, img, threshold, labeledOutputImage=False):
 	"""
 	Performs a tiny yolo detection on the tpu.
-	interpreter: interpreter object from make_interpreter()
-	anchors: 
+	session: TfliteSession built from the interpreter returned by make_interpreter()
 	img: image for inference 
-	classes: classes that are used by the interpreter model
 	threshold: float, bounding boxes with a confidence over this threshold will be kept
 	labeledOutputImage: bool, creates image with bounding boxes
 	"""
-	n_classes = len(classes)
-
-	input_details, output_details, input_shape = get_interpreter_details(interpreter)
-
 	# Run inference, get boxes
-	boxes, scores, pred_classes = inference(interpreter, img, anchors, n_classes, threshold)
+	boxes, scores, pred_classes = inference(session, img, threshold)
 	objs = get_output(boxes, pred_classes, scores, threshold)
 
 	if labeledOutputImage:
-		draw_boxes(img, boxes, scores, pred_classes, classes)
+		draw_boxes(img, boxes, scores, pred_classes, session.classes)
 	else:
 		img = None
 
@@ -0,0 +1,183 @@
+# Python-specific imports
+import collections
+import itertools
+import threading
+import numpy as np
+
+# Package-specific imports
+from tpu_utils_tiny_yolo import iou_matrix
+from find_intersect import DEFAULT_LANE
+
+# A vehicle track entering or leaving one lane of the ROI
+TrackEvent = collections.namedtuple('TrackEvent', ['kind', 'track_id', 'box', 'timestamp', 'lane'], defaults=(DEFAULT_LANE,))
+
+# Ids are unique across every tracker so events of different cameras never share one
+_track_ids = itertools.count(1)
+
+class Track:
+	"""
+		One vehicle followed across frames with a constant velocity model.
+		track_id: persistent id of the vehicle
+		box: [x, y, width, height] float array, predicted up to last_time
+		velocity: [dx, dy] in pixels per second
+		last_time: time the box was last moved to, by a detection or a prediction
+		last_seen: time of the last detection matched with the track
+		hits: number of detections matched with the track
+		in_roi: set of the lanes the vehicle is currently counted in
+	"""
+
+	def __init__(self, box, timestamp):
+		"""
+			Starts a track on an unmatched detection.
+		"""
+		self.track_id = next(_track_ids)
+		self.box = np.asarray(box, dtype=np.float64)
+		self.velocity = np.zeros(2)
+		self.last_time = timestamp
+		self.last_seen = timestamp
+		self.hits = 1
+		self.in_roi = set()
+
+	def predict(self, timestamp):
+		"""
+			Moves the box along the velocity up to timestamp.
+		"""
+		dt = timestamp - self.last_time
+		if dt > 0:
+			self.box[:2] += self.velocity * dt
+			self.last_time = timestamp
+
+	def update(self, box, timestamp, smoothing):
+		"""
+			Corrects the predicted box with a matched detection and updates the velocity.
+		"""
+		box = np.asarray(box, dtype=np.float64)
+		dt = timestamp - self.last_seen
+		if dt > 0:
+			# Position at the last detection, the box was only moved along the velocity since then
+			previous = self.box[:2] - self.velocity * (self.last_time - self.last_seen)
+			measured = (box[:2] - previous) / dt
+			self.velocity = smoothing * self.velocity + (1 - smoothing) * measured
+
+		self.box = box
+		self.last_time = timestamp
+		self.last_seen = timestamp
+		self.hits += 1
+
+class Tracker:
+	"""
+		Follows the vehicles of one camera between detections with IoU association and a constant velocity predictor,
+		so detection can run on a fraction of the captured frames. Enter and exit events come from the track state.
+		iou_threshold: minimum IoU between a predicted track and a detection to match them
+		max_age: seconds a track is kept without a matching detection
+		min_hits: detections needed before a track can enter a lane, filters single frame false positives
+		smoothing: 0.0-1.0 weight of the previous velocity when a new detection is matched
+		tracks: live tracks
+	"""
+
+	def __init__(self, iou_threshold=0.3, max_age=1.0, min_hits=2, smoothing=0.5):
+		"""
+			Basic setup of an empty tracker.
+		"""
+		self.iou_threshold = iou_threshold
+		self.max_age = max_age
+		self.min_hits = min_hits
+		self.smoothing = smoothing
+		self.tracks = []
+		self.lock = threading.Lock()
+
+	def predict(self, timestamp):
+		"""
+			Moves every track to timestamp and drops the ones without a detection for max_age, used on frames without detection.
+			returns the exit events of dropped tracks that were in a lane
+		"""
+		with self.lock:
+			for track in self.tracks:
+				track.predict(timestamp)
+			return self.__drop_lost(timestamp)
+
+	def update(self, boxes, accepted, timestamp, lanes=None, lane_names=None):
+		"""
+			Matches the detections of a frame with the tracks and updates the track states.
+			boxes: (N,4) array of [x, y, width, height] vehicle boxes
+			accepted: (N,) bool array, whether each box is within the ROI
+			timestamp: capture time of the frame
+			lanes: optional (L,N) bool array, whether each box is within each lane. accepted is the only lane when None
+			lane_names: names of the L lanes
+			returns the enter and exit events caused by this frame
+		"""
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		if lanes is None:
+			lanes, lane_names = np.asarray(accepted, dtype=bool).reshape(1, -1), (DEFAULT_LANE,)
+		lanes = np.asarray(lanes, dtype=bool).reshape(len(lane_names), len(boxes))
+		events = []
+
+		with self.lock:
+			for track in self.tracks:
+				track.predict(timestamp)
+
+			# Greedy association, best overlapping pairs first
+			matches = []
+			if self.tracks and len(boxes):
+				predicted = np.array([track.box for track in self.tracks])
+				iou = iou_matrix(self.__corners(predicted), self.__corners(boxes))
+				pairs = np.argwhere(iou >= self.iou_threshold)
+				pairs = pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]], kind="stable")]
+
+				used_tracks, used_boxes = set(), set()
+				for t, b in pairs:
+					if t not in used_tracks and b not in used_boxes:
+						used_tracks.add(t)
+						used_boxes.add(b)
+						matches.append((self.tracks[t], b))
+			else:
+				used_boxes = set()
+
+			for track, b in matches:
+				track.update(boxes[b], timestamp, self.smoothing)
+				events.extend(self.__transition(track, lane_names, lanes[:, b], timestamp))
+
+			for b in range(len(boxes)):
+				if b not in used_boxes:
+					track = Track(boxes[b], timestamp)
+					self.tracks.append(track)
+					events.extend(self.__transition(track, lane_names, lanes[:, b], timestamp))
+
+			events.extend(self.__drop_lost(timestamp))
+		return events
+
+	def __transition(self, track, lane_names, in_lanes, timestamp):
+		"""
+			Updates the lanes a track is in and returns the resulting events. Lanes that were removed are forgotten without an event.
+		"""
+		track.in_roi.intersection_update(lane_names)
+		events = []
+		for lane, in_lane in zip(lane_names, in_lanes):
+			if in_lane and lane not in track.in_roi and track.hits >= self.min_hits:
+				track.in_roi.add(lane)
+				events.append(TrackEvent("enter", track.track_id, track.box.copy(), timestamp, lane))
+			elif not in_lane and lane in track.in_roi:
+				track.in_roi.discard(lane)
+				events.append(TrackEvent("exit", track.track_id, track.box.copy(), timestamp, lane))
+		return events
+
+	def __drop_lost(self, timestamp):
+		"""
+			Removes tracks without a detection for max_age, a vehicle lost inside lanes exits them.
+		"""
+		events = []
+		kept = []
+		for track in self.tracks:
+			if timestamp - track.last_seen <= self.max_age:
+				kept.append(track)
+			else:
+				events.extend(TrackEvent("exit", track.track_id, track.box.copy(), timestamp, lane) for lane in sorted(track.in_roi))
+		self.tracks = kept
+		return events
+
+	@staticmethod
+	def __corners(boxes):
+		"""
+			Converts [x, y, width, height] boxes to the ((xmin, ymin), (xmax, ymax)) layout of iou_matrix.
+		"""
+		return np.stack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
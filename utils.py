@@ -3,7 +3,7 @@ import cv2
 from datetime import datetime
 from shapely.geometry import Polygon
 from imutils import resize
-from detect_image import make_interpreter
+from model_session import DnnSession, TfliteSession
 
 def add_frame_overlay(frame, camera_name="NOT_SPECIFIED"):
 	"""
@@ -38,8 +38,8 @@ def prepare_frame_for_display(frame,camera_name="NOT_SPECIFIED"):
 	_,frame = cv2.imencode(".jpg", frame)
 	return b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +  bytearray(frame) + b'\r\n' 
 
-def initialize_yolo(modelType="cpu-tiny-yolov3"):
-    """Loads model config and weights into darknet and returns object for inference"""
+def initialize_yolo(modelType="cpu-tiny-yolov3", warmup_runs=1, input_size=416):
+    """Loads model config and weights into darknet and returns a warmed up DnnSession for inference, input_size must be a multiple of 32"""
     print("[INFO] loading YOLO from disk...")
 
     if modelType == "cpu-tiny-yolov3":
@@ -50,12 +50,25 @@ def initialize_yolo(modelType="cpu-tiny-yolov3"):
         weightsPath = "yolo-coco/yolov3.weights"
 
     net =  cv2.dnn.readNetFromDarknet(configPath, weightsPath)
-    return net
+    session = DnnSession(net, input_size=(input_size, input_size))
+    session.warm_up(warmup_runs)
+    return session
 
 
 
-def initialize_tpu(modelType="tpu-tiny-yolov3"):
-    """Loads tflite model into tpu and returns object for tpu inference"""
+# Interpolations that can be used to resize frames into the tpu model input
+INTERPOLATIONS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+}
+
+def initialize_tpu(modelType="tpu-tiny-yolov3", warmup_runs=1, interpolation=None):
+    """
+    Loads tflite model into tpu and returns a warmed up TfliteSession for tpu inference
+    interpolation: name of the interpolation used to resize frames, see INTERPOLATIONS. None uses the model's default.
+    """
     print("[INFO] loading tflite model into TPU...")
     
     if modelType == "tpu-mobilenetv2":
@@ -63,6 +76,27 @@ def initialize_tpu(modelType="tpu-tiny-yolov3"):
     elif modelType == "tpu-tiny-yolov3":
         model = "models/quant_coco-tiny-v3-relu_edgetpu.tflite"
 
+    from detect_image import make_interpreter
     interpreter = make_interpreter(model)
     interpreter.allocate_tensors()
-    return interpreter
\ No newline at end of file
+    session = TfliteSession(interpreter, modelType,
+        interpolation=INTERPOLATIONS[interpolation] if interpolation else None)
+    session.warm_up(warmup_runs)
+    return session
+
+def build_detector(modelType, warmup_runs=1, interpolation=None, input_size=416, crop_to_roi=False, crop_padding=0.1):
+    """
+    Loads the model and returns the detection class running it, YoloVideo for the cpu models and tpuVideo for the tpu models.
+    Used by the app and by the inference worker processes so both build the same detector.
+    """
+    if modelType == "cpu-tiny-yolov3" or modelType == "cpu-yolov3":
+        from YoloVideo import YoloVideo
+        return YoloVideo(initialize_yolo(modelType=modelType, warmup_runs=warmup_runs, input_size=input_size),
+            crop_to_roi=crop_to_roi, crop_padding=crop_padding)
+
+    elif modelType == "tpu-tiny-yolov3" or modelType == "tpu-mobilenetv2":
+        from tpuVideo import tpuVideo
+        return tpuVideo(initialize_tpu(modelType=modelType, warmup_runs=warmup_runs, interpolation=interpolation), modelType=modelType,
+            crop_to_roi=crop_to_roi, crop_padding=crop_padding)
+
+    raise ValueError("Unknown model {}, choose between cpu-yolov3, cpu-tiny-yolov3, tpu-tiny-yolov3, tpu-mobilenetv2".format(modelType))
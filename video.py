@@ -1,30 +1,80 @@
-from camera import Camera 
+from camera import Camera
+from capture import VideoCaptureThread, REALTIME, BATCH
 import cv2
 
 class Video(Camera):
+	"""
+		Camera reading from a video file. The file is decoded on its own thread into a small ring of frames.
+		policy: realtime plays the file at its native fps and drops frames to keep up, batch decodes every frame as fast as it is consumed
+		ring_size: number of decoded frames kept
+	"""
 
-	def __init__(self,url):
+	def __init__(self,url,policy=REALTIME,ring_size=4):
+		self.policy = policy
+		self.ring_size = ring_size
 		super(Video,self).__init__(url)
-		
+
 	def __iter__(self):
 		return VideoIterator(self)
 
 	def build_video_stream(self,video_path):
-		self.VS = cv2.VideoCapture(video_path) 
+		self.VS = cv2.VideoCapture(video_path)
 		grabbed, sample_frame = self.VS.read()
+		if grabbed:
+			# A reopened file continues the sequence numbers of the previous one
+			previous = getattr(self, "capture_thread", None)
+			self.capture_thread = VideoCaptureThread(video_path, self.VS, sample_frame, policy=self.policy, ring_size=self.ring_size,
+				first_seq=previous.ring.seq if previous is not None else 0)
+			self.capture_thread.start()
+		else:
+			self.VS.release()
 		return sample_frame
 
+	def latest(self):
+		"""
+			Returns a copy of the newest decoded frame as a CapturedFrame, tagged as stale while the file is being reopened
+		"""
+		captured = self.capture_thread.ring.latest()
+		if self.stalled() or self.watchdog.reconnecting:
+			captured = captured._replace(stale=True)
+		return captured
+
+	def stalled(self):
+		"""
+			Whether the decode thread stopped. A file never waits for frames, in batch mode decode even waits for the consumer.
+		"""
+		return not self.capture_thread.is_alive()
+
+	def close_stream(self):
+		"""
+			Stops the decode thread and closes the file
+		"""
+		self.capture_thread.stop()
+
 
 
 class VideoIterator:
 	def __init__(self, video):
 		self.video = video
-		#self.VS = cv2.VideoCapture(self.video.url)
+		self.last_seq = 0
+		self.last = None
+
+	def __iter__(self):
+		return self
 
 	def __next__(self):
+		ring = self.video.capture_thread.ring
+
+		# Batch consumers get every frame in order, others the newest frame without waiting for decode
+		if self.video.policy == BATCH:
+			captured = ring.next(self.last_seq, timeout=0.5)
+			if captured is None:
+				# Nothing decoded in time, decode may have stopped until the watchdog reopens the file
+				stale = self.video.stalled() or self.video.watchdog.reconnecting
+				captured = (self.last or ring.latest())._replace(stale=stale)
+		else:
+			captured = self.video.latest()
 
-		grabbed,frame = self.video.VS.read()
-		if grabbed == False: 
-			self.video.initialize_video_stream(self.video.url)
-			grabbed,frame = self.video.VS.read()
-		return frame 
+		self.last_seq = captured.seq
+		self.last = captured
+		return captured.frame